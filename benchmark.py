@@ -0,0 +1,273 @@
+# benchmark.py: times every engine and propagation mode over the bundled puzzles and generated big ones, and compares
+# the results against a stored baseline. Timings only compare on the same machine, so the baseline isn't kept in the
+# repo: make one from the commit to compare against with
+#     python benchmark.py --out baseline.json
+# and then check a change with
+#     python benchmark.py --baseline baseline.json
+# which lists what got worse on stderr and exits non-zero if anything did.
+
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sys
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows; peak RSS just isn't recorded there
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Only needed for the vectorized propagation mode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'sudoku'))
+
+import numbrix_solver  # noqa: E402
+import sudoku_solver  # noqa: E402
+from bitmask_solver import BitmaskSudokuSolver  # noqa: E402
+from bitset_solver import BitsetSolver  # noqa: E402
+from cdcl_solver import CDCLSolver  # noqa: E402
+from dlx_solver import DLXSolver  # noqa: E402
+from logic_solver import LogicSolver  # noqa: E402
+from puzzle_io import iter_puzzles  # noqa: E402
+
+# (engine, propagation mode) pairs to run, and the puzzle types each applies to. 'vectorized' is LogicSolver with
+# propagate_vectorized; 'native' is a dedicated engine with no separate model or propagation step.
+CONFIGS = [('logic', 'plain', ('sudoku', 'numbrix')),
+           ('logic', 'pairs', ('sudoku', 'numbrix')),
+           ('logic', 'triplets', ('sudoku', 'numbrix')),
+           ('logic', 'vectorized', ('sudoku', 'numbrix')),
+           ('bitset', 'plain', ('sudoku', 'numbrix')),
+           ('bitset', 'pairs', ('sudoku', 'numbrix')),
+           ('bitset', 'triplets', ('sudoku', 'numbrix')),
+           ('cdcl', 'plain', ('sudoku', 'numbrix')),
+           ('dlx', 'plain', ('sudoku',)),
+           ('bitmask', 'native', ('sudoku',))]
+
+# Measurements compared against the baseline: timings may drift by the tolerance, counts should not grow at all
+TIMINGS = ['build_ms', 'propagate_ms', 'solve_ms']
+COUNTS = ['nodes', 'eqns_remaining']
+
+
+def bundled_instances():
+    # (name, puzzle type, board) for every puzzle under sudoku/puzzles and numbrix/puzzles
+    for puzzle_type, puzzle_format in (('sudoku', 'grid'), ('numbrix', 'numbrix')):
+        for path in sorted(glob.glob(os.path.join(ROOT, puzzle_type, 'puzzles', '*.txt'))):
+            for puzzle_id, board in iter_puzzles(path, puzzle_format):
+                yield os.path.relpath(puzzle_id, ROOT).replace(os.sep, '/'), puzzle_type, board
+
+
+def generated_instances(seed):
+    # Big instances the bundled puzzles don't cover, the same every run for a given seed. Each gets a generator of
+    # its own, so changing one doesn't change the others.
+    for name, puzzle_type, generate, args in (('sudoku16', 'sudoku', generate_sudoku, (16, 0.4)),
+                                              ('sudoku25', 'sudoku', generate_sudoku, (25, 0.6)),
+                                              ('numbrix12', 'numbrix', generate_numbrix, (12, 13)),
+                                              ('numbrix16', 'numbrix', generate_numbrix, (16, 16))):
+        rng = random.Random('{}/{}'.format(seed, name))
+        yield 'generated/' + name, puzzle_type, generate(*args, rng)
+
+
+def generate_sudoku(side_length, clue_fraction, rng):
+    # A board with a solution made by shuffling the digits, rows and columns of the standard pattern (within the
+    # moves that keep it valid), keeping each cell as a clue with probability clue_fraction
+    block_size = math.isqrt(side_length)
+    blocks = range(block_size)
+
+    def shuffled_lines():
+        return [b * block_size + i for b in rng.sample(blocks, block_size) for i in rng.sample(blocks, block_size)]
+
+    digits = rng.sample(range(1, side_length + 1), side_length)
+    rows, cols = shuffled_lines(), shuffled_lines()
+    return [[digits[(block_size * (r % block_size) + r // block_size + c) % side_length]
+             if rng.random() < clue_fraction else 0 for c in cols] for r in rows]
+
+
+def generate_numbrix(side_length, spacing, rng):
+    # A board whose solution is a snake through the rows, turned or mirrored at random, with a clue every spacing
+    # steps along it and at both ends
+    path = [(r, c if r % 2 == 0 else side_length - 1 - c) for r in range(side_length) for c in range(side_length)]
+    if rng.random() < 0.5:
+        path = [(c, r) for r, c in path]
+    if rng.random() < 0.5:
+        path = [(r, side_length - 1 - c) for r, c in path]
+    board = [[0] * side_length for _ in range(side_length)]
+    for v, (r, c) in enumerate(path):
+        if v % spacing == 0 or v == len(path) - 1:
+            board[r][c] = v + 1
+    return board
+
+
+def make_solver(engine, mode):
+    if engine == 'logic':
+        return LogicSolver(pair_reductions=mode in ('pairs', 'triplets'), triplet_reductions=mode == 'triplets')
+    if engine == 'bitset':
+        return BitsetSolver(pair_reductions=mode in ('pairs', 'triplets'), triplet_reductions=mode == 'triplets')
+    if engine == 'cdcl':
+        return CDCLSolver()
+    if engine == 'dlx':
+        return DLXSolver()
+    raise ValueError('Unknown engine {}'.format(engine))
+
+
+def run_case(puzzle_type, board, engine, mode):
+    # Builds, propagates and solves one instance in this process, returning the measurements. Meant to run in a
+    # fresh worker process, so the peak RSS is this case's alone.
+    board = [row[:] for row in board]
+    result = {}
+    t_start = perf_counter()
+    if engine == 'bitmask':
+        # Builds its state and solves in one go
+        solver = BitmaskSudokuSolver(board)
+        result['solve_ms'] = (perf_counter() - t_start) * 1000
+        result['solved'] = solver.is_solved()
+    else:
+        solver = make_solver(engine, mode)
+        if puzzle_type == 'sudoku':
+            sudoku_solver.board_to_prop_sets(solver, board)
+        else:
+            numbrix_solver.board_to_prop_sets(solver, board)
+        t_built = perf_counter()
+        conflict = solver.propagate_vectorized() if mode == 'vectorized' else solver.propagate()
+        t_propagated = perf_counter()
+        result['eqns_remaining'] = solver.get_num_sets()
+        result['solved'] = conflict is None and solver.solve()
+        t_solved = perf_counter()
+        result['build_ms'] = (t_built - t_start) * 1000
+        result['propagate_ms'] = (t_propagated - t_built) * 1000
+        result['solve_ms'] = (t_solved - t_propagated) * 1000
+
+    stats = solver.get_stats()
+    result['nodes'] = stats.get('decisions', stats.get('nodes'))
+    if resource is not None:
+        # Kilobytes on Linux, bytes on macOS
+        scale = 1024 if sys.platform == 'darwin' else 1
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    return result
+
+
+def run_isolated(case, timeout):
+    # run_case in a worker process of its own. Returns its result, or {'status': 'timeout'} if it takes longer than
+    # timeout seconds (the worker is killed).
+    with multiprocessing.Pool(1) as pool:
+        pending = pool.apply_async(run_case, case)
+        try:
+            result = pending.get(timeout)
+        except multiprocessing.TimeoutError:
+            return {'status': 'timeout'}
+    result['status'] = 'solved' if result.pop('solved') else 'unsolved'
+    return result
+
+
+def run_benchmarks(instances, configs, repeat=3, timeout=60.0, only=None, log=None):
+    # Runs every config that applies to every instance repeat times, and returns one result dict per pair: its
+    # timings are the fastest of the runs, which is the least disturbed by whatever else the machine was doing.
+    # only, if given, keeps just the cases whose instance/engine/mode key contains it.
+    results = []
+    for name, puzzle_type, board in instances:
+        for engine, mode, puzzle_types in configs:
+            key = '{}/{}/{}'.format(name, engine, mode)
+            if puzzle_type not in puzzle_types or (mode == 'vectorized' and numpy is None):
+                continue
+            if only is not None and only not in key:
+                continue
+            runs = []
+            for _ in range(repeat):
+                runs.append(run_isolated((puzzle_type, board, engine, mode), timeout))
+                if runs[-1]['status'] == 'timeout':
+                    break  # Another go would only time out again
+            result = {'instance': name, 'engine': engine, 'mode': mode}
+            result.update(runs[0])
+            for field in TIMINGS + ['peak_rss_kb']:
+                if field in result:
+                    result[field] = min(run[field] for run in runs)
+            for field in TIMINGS:
+                if field in result:
+                    result[field] = round(result[field], 3)
+            results.append(result)
+            if log is not None:
+                print(format_result(result), file=log)
+    return results
+
+
+def format_result(result):
+    timings = ' '.join('{}={}'.format(field, result[field]) for field in TIMINGS + COUNTS + ['peak_rss_kb']
+                       if result.get(field) is not None)
+    return '{}/{}/{}: {} {}'.format(result['instance'], result['engine'], result['mode'], result['status'], timings)
+
+
+def compare(results, baseline, tolerance=0.25, min_ms=2.0):
+    # Lists what got worse since baseline (results from an earlier run): a case that no longer solves or now times
+    # out, a timing more than tolerance (a fraction) and min_ms over its baseline, or a count that went up. Cases
+    # missing from either side are skipped.
+    by_key = {(r['instance'], r['engine'], r['mode']): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result['instance'], result['engine'], result['mode'])
+        old = by_key.get(key)
+        if old is None:
+            continue
+        label = '/'.join(key)
+        if old['status'] != result['status'] and old['status'] == 'solved':
+            regressions.append('{}: {} (was {})'.format(label, result['status'], old['status']))
+            continue
+        for field in TIMINGS:
+            if result.get(field) is None or old.get(field) is None:
+                continue
+            if result[field] > old[field] * (1 + tolerance) and result[field] - old[field] > min_ms:
+                regressions.append('{}: {} {} (was {}, {:+.0%})'.format(label, field, result[field], old[field],
+                                                                        result[field] / old[field] - 1))
+        for field in COUNTS:
+            if result.get(field) is not None and old.get(field) is not None and result[field] > old[field]:
+                regressions.append('{}: {} {} (was {})'.format(label, field, result[field], old[field]))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Benchmark the solvers over the puzzle corpus')
+    parser.add_argument('--out', help='file to write the results to as JSON (default: standard output)')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--only', help='run just the cases whose instance/engine/mode contains this')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the fastest counts (default: 3)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds allowed per run (default: 60)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower than the baseline a timing may get, as a fraction (default: 0.25)')
+    parser.add_argument('--seed', type=int, default=2017, help='seed for the generated instances')
+    parser.add_argument('--no-generated', action='store_true', help='only run the bundled puzzles')
+    args = parser.parse_args(argv[1:])
+
+    instances = list(bundled_instances())
+    if not args.no_generated:
+        instances += list(generated_instances(args.seed))
+    results = run_benchmarks(instances, CONFIGS, args.repeat, args.timeout, args.only, log=sys.stderr)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed,
+              'numpy': numpy is not None, 'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        print('{} regressions against {}'.format(len(regressions), args.baseline), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,323 @@
+# bitset_solver.py: a LogicSolver backend keeping equations and knowledge as bitsets over a fixed universe
+
+from time import perf_counter
+from logic_solver import SymbolTable, Conflict, Not, eqn_type_bounds
+
+
+class BitsetSolver:
+
+    def __init__(self, verbose=False, pair_reductions=False, triplet_reductions=False):
+        self._verbose = verbose
+        self._pair_reductions = pair_reductions
+        self._triplet_reductions = triplet_reductions
+
+        # Proposition i is bit i of every mask below. Puzzle models intern their whole universe up front, so the
+        # masks are as dense as they can be.
+        self._symbols = SymbolTable()
+
+        # Equation e covers the propositions in _eqn_masks[e] and the negations of those in _eqn_neg_masks[e], and
+        # allows between _eqn_lo[e] and _eqn_hi[e] of its members to be True. Those never change; what's left of an
+        # equation follows from the knowledge masks.
+        self._eqn_masks = []
+        self._eqn_neg_masks = []
+        self._eqn_lo = []
+        self._eqn_hi = []
+        # For each proposition, the mask of the equations that contain it (bit e for equation e)
+        self._prop_eqns = []
+        # Masks of the equations that are XORs without negated members as added, and of those triplet reduction made
+        self._xor_eqns = 0
+        self._derived_eqns = 0
+
+        # What we know: masks of the True and False propositions, and of the facts not yet propagated
+        self._true_mask = 0
+        self._false_mask = 0
+        self._pending = 0
+
+        self._conflict = None
+
+        self._stats = {'rounds': 0, 'eqns_evaluated': 0, 'pair_passes': 0, 'pair_time': 0.0, 'triplet_passes': 0,
+                       'triplet_time': 0.0, 'triplet_eqns_added': 0, 'decisions': 0}
+
+    def add_equation(self, proposition_list, eqn_type, count=None):
+        # Adds an equation: the propositions in proposition_list will be related by the relation _type_ (XOR, OR, etc).
+        # The 'atleast', 'atmost' and 'exactly' types bound the number of true propositions by count. A member may
+        # be given as Not(prop).
+        masks = [0, 0]
+        for prop in proposition_list:
+            prop_id, negated = self._literal(prop)
+            masks[negated] |= 1 << prop_id
+        lo, hi = eqn_type_bounds(eqn_type, masks[0].bit_count() + masks[1].bit_count(), count)
+        self._add_eqn(masks[0], lo, hi, neg_mask=masks[1])
+
+    def add_true_propositions(self, proposition_list):
+        # Marks all the propositions in the given iterable True in this solver
+        self.add_knowledge({i: True for i in proposition_list})
+
+    def add_false_propositions(self, proposition_list):
+        # Marks all the propositions in the given iterable False in this solver
+        self.add_knowledge({i: False for i in proposition_list})
+
+    def add_knowledge(self, proposition_to_bool_dict):
+        # Marks propositions True and False based on values in given dictionary
+        true_mask, false_mask = 0, 0
+        for prop, value in proposition_to_bool_dict.items():
+            prop_id, negated = self._literal(prop)
+            if bool(value) != negated:
+                true_mask |= 1 << prop_id
+            else:
+                false_mask |= 1 << prop_id
+        self._learn(true_mask, false_mask, [])
+
+    def run_iter(self):
+        # Runs a round: evaluate every equation touched by the facts learned since the last one, all at once.
+        # Returns the Conflict if one was found (now or before), otherwise None.
+        if self._conflict is None and self._pending:
+            self._round()
+        if self._conflict is None and not self._pending and self._pair_reductions:
+            self._pair_reduce()
+        if self._conflict is None and not self._pending and self._triplet_reductions:
+            self._triplet_reduce()
+        return self._conflict
+
+    def propagate(self):
+        # Runs rounds until nothing new follows, or until a contradiction. Returns the Conflict in the latter case,
+        # otherwise None.
+        while self._conflict is None:
+            eqn_count = len(self._eqn_masks)
+            self.run_iter()
+            if not self._pending and len(self._eqn_masks) == eqn_count:
+                break
+        return self._conflict
+
+    def solve(self):
+        # Propagate, then search: assume the lowest unknown member of the smallest open equation True, and on a
+        # contradiction False instead. The whole state is the two knowledge masks, so a branch saves just those.
+        # Returns True with the solution in get_knowledge(), or False if there is none.
+        if self.propagate() is not None:
+            return False
+
+        reductions = self._triplet_reductions
+        self._triplet_reductions = False  # Derived equations only hold given the facts they were derived under
+        try:
+            # One entry per assumption in force: (masks before it, proposition bit, whether it's the second try)
+            decisions = []
+            while True:
+                bit = self._pick_branch()
+                if bit is None:
+                    return True
+                self._stats['decisions'] += 1
+                decisions.append((self._true_mask, self._false_mask, bit, False))
+                self._learn(bit, 0, [])
+
+                while self.propagate() is not None:
+                    while decisions:
+                        true_mask, false_mask, bit, is_second_try = decisions.pop()
+                        self._true_mask, self._false_mask = true_mask, false_mask
+                        self._pending = 0
+                        self._conflict = None
+                        if not is_second_try:
+                            decisions.append((true_mask, false_mask, bit, True))
+                            self._learn(0, bit, [])
+                            break
+                    else:
+                        return False
+        finally:
+            self._triplet_reductions = reductions
+
+    def get_conflict(self):
+        return self._conflict
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    def get_num_sets(self):
+        return sum(1 for e in range(len(self._eqn_masks)) if self._has_info(e))
+
+    def is_done(self):
+        # If this is True, no point to further iterations
+        return self.get_num_sets() == 0
+
+    def get_knowledge(self):
+        # Returns (pos_knowledge, neg_knowledge) tuple of all things we know so far
+        lookup = self._symbols.lookup
+        pos_knowledge = {lookup(i): True for i in iter_bits(self._true_mask)}
+        neg_knowledge = {lookup(i): False for i in iter_bits(self._false_mask)}
+        return pos_knowledge, neg_knowledge
+
+    # Internals
+
+    def _intern(self, prop):
+        prop_id = self._symbols.intern(prop)
+        if prop_id == len(self._prop_eqns):
+            self._prop_eqns.append(0)
+        return prop_id
+
+    def _literal(self, prop):
+        # (proposition ID, whether it's negated) for an equation member or knowledge key
+        negated = False
+        while isinstance(prop, Not):
+            prop = prop.prop
+            negated = not negated
+        return self._intern(prop), negated
+
+    def _add_eqn(self, mask, lo, hi, derived=False, neg_mask=0):
+        e = len(self._eqn_masks)
+        self._eqn_masks.append(mask)
+        self._eqn_neg_masks.append(neg_mask)
+        self._eqn_lo.append(lo)
+        self._eqn_hi.append(hi)
+        for prop_id in iter_bits(mask | neg_mask):
+            self._prop_eqns[prop_id] |= 1 << e
+        if lo == hi == 1 and not neg_mask:
+            self._xor_eqns |= 1 << e
+        if derived:
+            self._derived_eqns |= 1 << e
+        self._evaluate(e)
+
+    def _learn(self, true_mask, false_mask, eqn_ids):
+        # Records new facts, blaming equations eqn_ids if they contradict each other or what we knew
+        clash = (true_mask & (false_mask | self._false_mask)) | (false_mask & self._true_mask)
+        if clash:
+            if self._conflict is None:
+                prop = self._symbols.lookup((clash & -clash).bit_length() - 1)
+                self._conflict = self._make_conflict('clash', eqn_ids, prop)
+            return
+        new_facts = (true_mask & ~self._true_mask) | (false_mask & ~self._false_mask)
+        self._true_mask |= true_mask
+        self._false_mask |= false_mask
+        self._pending |= new_facts
+
+    def _round(self):
+        # The equations touched by the pending facts are those whose mask intersects them
+        batch, self._pending = self._pending, 0
+        touched = 0
+        for prop_id in iter_bits(batch):
+            touched |= self._prop_eqns[prop_id]
+        self._stats['rounds'] += 1
+        self._stats['eqns_evaluated'] += touched.bit_count()
+        for e in iter_bits(touched):
+            self._evaluate(e)
+            if self._conflict is not None:
+                return
+
+    def _evaluate(self, e):
+        # If what's left of the equation has collapsed to an AND or a NOR, learn everything left in it
+        mask, neg_mask = self._eqn_masks[e], self._eqn_neg_masks[e]
+        unknown_mask = ~(self._true_mask | self._false_mask)
+        trues = self._trues(e)
+        unknown = (mask & unknown_mask).bit_count() + (neg_mask & unknown_mask).bit_count()
+        lo = max(self._eqn_lo[e] - trues, 0)
+        hi = min(self._eqn_hi[e] - trues, unknown)
+        if lo > hi:
+            if self._conflict is None:
+                self._conflict = self._make_conflict('empty range', [e], None)
+        elif unknown and lo == unknown:
+            self._learn(mask & unknown_mask, neg_mask & unknown_mask, [e])
+        elif unknown and hi == 0:
+            self._learn(neg_mask & unknown_mask, mask & unknown_mask, [e])
+
+    def _trues(self, e):
+        # Number of the equation's members known to be True
+        return (self._eqn_masks[e] & self._true_mask).bit_count() + \
+            (self._eqn_neg_masks[e] & self._false_mask).bit_count()
+
+    def _remaining(self, e):
+        return (self._eqn_masks[e] | self._eqn_neg_masks[e]) & ~(self._true_mask | self._false_mask)
+
+    def _is_xor(self, e):
+        # Exactly one of what's left of the equation must be True
+        mask = self._eqn_masks[e]
+        if mask & self._true_mask:
+            return False
+        return self._eqn_lo[e] == 1 and min(self._eqn_hi[e], (mask & ~self._false_mask).bit_count()) == 1
+
+    def _has_info(self, e):
+        remaining = self._remaining(e)
+        trues = self._trues(e)
+        return remaining != 0 and (self._eqn_lo[e] - trues > 0 or self._eqn_hi[e] - trues < remaining.bit_count())
+
+    def _open_xors(self):
+        # Mask of the equations that are XORs over what's left of them
+        return sum(1 << e for e in iter_bits(self._xor_eqns) if self._remaining(e) and self._is_xor(e))
+
+    def _containing_all(self, members):
+        # Mask of the equations that contain every proposition in members
+        eqns = -1
+        for prop_id in iter_bits(members):
+            eqns &= self._prop_eqns[prop_id]
+        return eqns
+
+    def _pair_reduce(self):
+        # If XOR A's remaining members are a proper subset of XOR B's, everything in B outside A is False. The XORs
+        # containing all of A are the AND of its members' equation masks.
+        t_start = perf_counter()
+        xors = self._open_xors()
+        for a in iter_bits(xors):
+            rem_a = self._remaining(a)
+            for b in iter_bits(self._containing_all(rem_a) & xors & ~(1 << a)):
+                rest = self._remaining(b) & ~rem_a
+                if rest:
+                    self._learn(0, rest, [b, a])
+            if self._conflict is not None:
+                break
+        self._stats['pair_passes'] += 1
+        self._stats['pair_time'] += perf_counter() - t_start
+
+    def _triplet_reduce(self):
+        # Disjoint XORs A and C covering XOR B give the XOR (A | C) & ~B; see LogicSolver._triplet_reduce. Candidate
+        # Cs are the XORs containing all of B outside A. Derived equations are keyed by their mask, and not combined
+        # any further.
+        t_start = perf_counter()
+        xors = self._open_xors() & ~self._derived_eqns
+        known_masks = {mask for mask, neg_mask in zip(self._eqn_masks, self._eqn_neg_masks) if not neg_mask}
+        derived = []
+        for b in iter_bits(xors):
+            rem_b = self._remaining(b)
+            overlapping = 0
+            for prop_id in iter_bits(rem_b):
+                overlapping |= self._prop_eqns[prop_id]
+            for a in iter_bits(overlapping & xors & ~(1 << b)):
+                rem_a = self._remaining(a)
+                rest_of_b = rem_b & ~rem_a
+                if rest_of_b == rem_b or not rest_of_b:
+                    continue
+                for c in iter_bits(self._containing_all(rest_of_b) & xors & ~(1 << a) & ~(1 << b)):
+                    rem_c = self._remaining(c)
+                    if rem_c & rem_a:
+                        continue
+                    new_mask = (rem_a | rem_c) & ~rem_b
+                    if new_mask not in known_masks:
+                        known_masks.add(new_mask)
+                        derived.append(new_mask)
+        for new_mask in derived:
+            self._add_eqn(new_mask, 1, 1, derived=True)
+        self._stats['triplet_passes'] += 1
+        self._stats['triplet_time'] += perf_counter() - t_start
+        self._stats['triplet_eqns_added'] += len(derived)
+
+    def _pick_branch(self):
+        # Lowest unknown member of the open equation with the fewest unknown members
+        best, best_count = 0, None
+        for e in range(len(self._eqn_masks)):
+            if self._has_info(e):
+                remaining = self._remaining(e)
+                count = remaining.bit_count()
+                if best_count is None or count < best_count:
+                    best, best_count = remaining, count
+                    if count <= 2:
+                        break
+        return best & -best if best else None
+
+    def _make_conflict(self, reason, eqn_ids, prop):
+        lookup = self._symbols.lookup
+        eqns = [[lookup(i) for i in iter_bits(self._eqn_masks[e])] +
+                [Not(lookup(i)) for i in iter_bits(self._eqn_neg_masks[e])] for e in eqn_ids]
+        return Conflict(reason, eqns, prop, eqn_ids)
+
+
+def iter_bits(mask):
+    # Yields the indices of the set bits of mask, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
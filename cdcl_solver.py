@@ -0,0 +1,508 @@
+# cdcl_solver.py: a conflict-driven clause learning engine behind the LogicSolver interface
+
+from array import array
+import heapq
+import sys
+from logic_solver import SymbolTable, Conflict, Not, eqn_type_bounds, UNKNOWN
+
+
+class CDCLSolver:
+
+    def __init__(self, verbose=False):
+        self._verbose = verbose
+
+        # Propositions are interned to variable IDs just like in LogicSolver. The encoding of cardinality equations
+        # needs extra variables of its own, which are interned as AuxVariable objects and never reported.
+        self._symbols = SymbolTable()
+        self._aux_count = 0
+
+        # Each equation as added, as the list of its member literals, so conflicts can name them
+        self._eqns = []
+
+        # Per-variable state, indexed by ID: the value (UNKNOWN, 0 or 1), the decision level it was set at, the
+        # clause that forced it (or NO_CLAUSE), the VSIDS activity and the saved phase
+        self._values = array('b')
+        self._levels = array('i')
+        self._reasons = array('i')
+        self._activity = array('d')
+        self._polarity = array('b')
+        self._seen = bytearray()
+
+        # Literals are 2*v for "v is True" and 2*v+1 for "v is False". Each literal has a list of the clauses
+        # watching it; a clause watches its first two literals.
+        self._watches = []
+
+        # Clause store. Deleted learned clauses are set to None and fall out of the watch lists lazily.
+        self._clauses = []
+        self._clause_eqn = array('i')  # The equation each clause encodes, or NO_EQN for learned ones
+        self._clause_activity = array('d')
+        self._learnts = []
+
+        self._trail = []
+        self._trail_lim = []
+        self._qhead = 0
+
+        # VSIDS: a max-heap of (-activity, var) with stale entries skipped when popped
+        self._heap = []
+        self._var_inc = 1.0
+        self._clause_inc = 1.0
+        self._max_learnts = None
+
+        # Set once we've shown the equations can't all hold
+        self._conflict = None
+
+        self._stats = {'decisions': 0, 'conflicts': 0, 'propagations': 0, 'restarts': 0, 'learned_total': 0,
+                       'learned_deleted': 0}
+
+    def add_equation(self, proposition_list, eqn_type, count=None):
+        # Adds an equation: the propositions in proposition_list will be related by the relation _type_ (XOR, OR, etc).
+        # The 'atleast', 'atmost' and 'exactly' types bound the number of true propositions by count. A member may
+        # be given as Not(prop).
+        # It's encoded as clauses: "at least lo" is "at most n-lo" over the negated literals.
+        self._cancel_until(0)
+        lits = [self._literal(prop) for prop in dict.fromkeys(proposition_list)]
+        lo, hi = eqn_type_bounds(eqn_type, len(lits), count)
+
+        e = len(self._eqns)
+        self._eqns.append(lits)
+        if hi < len(lits):
+            self._add_at_most(lits, hi, e)
+        if lo > 0:
+            self._add_at_most([lit ^ 1 for lit in lits], len(lits) - lo, e)
+
+    def add_true_propositions(self, proposition_list):
+        # Marks all the propositions in the given iterable True in this solver
+        self.add_knowledge({i: True for i in proposition_list})
+
+    def add_false_propositions(self, proposition_list):
+        # Marks all the propositions in the given iterable False in this solver
+        self.add_knowledge({i: False for i in proposition_list})
+
+    def add_knowledge(self, proposition_to_bool_dict):
+        # Marks propositions True and False based on values in given dictionary, as unit clauses
+        self._cancel_until(0)
+        for prop, value in proposition_to_bool_dict.items():
+            lit = self._literal(prop)
+            self._add_clause([lit if value else lit ^ 1], NO_EQN)
+
+    def propagate(self):
+        # Runs unit propagation on what we know for certain. Returns a Conflict if that's already contradictory,
+        # otherwise None.
+        self._cancel_until(0)
+        if self._conflict is None:
+            confl = self._propagate()
+            if confl != NO_CLAUSE:
+                self._set_conflict(confl)
+        return self.get_conflict()
+
+    def solve(self):
+        # CDCL search with restarts on the Luby sequence. Returns True with the solution in get_knowledge(), or
+        # False if there is none.
+        if self.propagate() is not None:
+            return False
+        if self._max_learnts is None:
+            self._max_learnts = max(len(self._clauses) / 3, 1000)
+
+        restarts = 0
+        while True:
+            status = self._search(RESTART_BASE * luby(restarts))
+            if status is not None:
+                return status
+            restarts += 1
+            self._stats['restarts'] += 1
+            self._max_learnts *= 1.1
+
+    def get_conflict(self):
+        # Returns a Conflict describing why the equations can't all hold, or None if we haven't found out yet
+        return self._conflict
+
+    def get_num_sets(self):
+        return sum(1 for c in self._clauses if c is not None)
+
+    def is_done(self):
+        # If this is True, every proposition has a value
+        return self._conflict is None and len(self._trail) == len(self._values)
+
+    def get_knowledge(self):
+        # Returns (pos_knowledge, neg_knowledge) tuple of all things we know so far (after solve(), the solution)
+        lookup = self._symbols.lookup
+        values = self._values
+        pos_knowledge, neg_knowledge = {}, {}
+        for v in self._trail:
+            v >>= 1
+            prop = lookup(v)
+            if isinstance(prop, AuxVariable):
+                continue
+            if values[v]:
+                pos_knowledge[prop] = True
+            else:
+                neg_knowledge[prop] = False
+        return pos_knowledge, neg_knowledge
+
+    def get_stats(self):
+        # Search counters, plus the size of the learned clause database
+        learnts = [self._clauses[ci] for ci in self._learnts]
+        stats = dict(self._stats)
+        stats['variables'] = len(self._values)
+        stats['clauses'] = self.get_num_sets() - len(learnts)
+        stats['learned_clauses'] = len(learnts)
+        stats['learned_literals'] = sum(len(c) for c in learnts)
+        stats['learned_bytes'] = sum(sys.getsizeof(c) for c in learnts)
+        return stats
+
+    # Internals: everything below works on variable IDs and literals
+
+    def _intern(self, prop):
+        v = self._symbols.intern(prop)
+        if v == len(self._values):
+            self._values.append(UNKNOWN)
+            self._levels.append(0)
+            self._reasons.append(NO_CLAUSE)
+            self._activity.append(0.0)
+            self._polarity.append(0)
+            self._seen.append(0)
+            self._watches.append([])
+            self._watches.append([])
+            heapq.heappush(self._heap, (0.0, v))
+        return v
+
+    def _literal(self, prop):
+        # 2*v for a proposition, 2*v+1 for Not(proposition)
+        negated = 0
+        while isinstance(prop, Not):
+            prop = prop.prop
+            negated ^= 1
+        return 2 * self._intern(prop) + negated
+
+    def _new_aux(self):
+        self._aux_count += 1
+        return self._intern(AuxVariable(self._aux_count))
+
+    def _lit_value(self, lit):
+        # 1 if the literal is True, 0 if False, UNKNOWN if its variable is unassigned
+        value = self._values[lit >> 1]
+        return value if value == UNKNOWN else value ^ (lit & 1)
+
+    def _add_at_most(self, lits, k, e):
+        # Clauses for "at most k of lits are True", as part of equation e
+        n = len(lits)
+        if k < 0:
+            self._add_clause([], e)
+        elif k == 0:
+            for lit in lits:
+                self._add_clause([lit ^ 1], e)
+        elif k >= n:
+            return
+        elif k == n - 1:
+            self._add_clause([lit ^ 1 for lit in lits], e)
+        elif k == 1 and n <= PAIRWISE_LIMIT:
+            for i in range(n):
+                for j in range(i + 1, n):
+                    self._add_clause([lits[i] ^ 1, lits[j] ^ 1], e)
+        else:
+            # Sequential counter (Sinz 2005): s[i][j] means at least j+1 of the first i+1 literals are True
+            s = [[2 * self._new_aux() for _ in range(k)] for _ in range(n - 1)]
+            self._add_clause([lits[0] ^ 1, s[0][0]], e)
+            for j in range(1, k):
+                self._add_clause([s[0][j] ^ 1], e)
+            for i in range(1, n - 1):
+                self._add_clause([lits[i] ^ 1, s[i][0]], e)
+                self._add_clause([s[i - 1][0] ^ 1, s[i][0]], e)
+                for j in range(1, k):
+                    self._add_clause([lits[i] ^ 1, s[i - 1][j - 1] ^ 1, s[i][j]], e)
+                    self._add_clause([s[i - 1][j] ^ 1, s[i][j]], e)
+                self._add_clause([lits[i] ^ 1, s[i - 1][k - 1] ^ 1], e)
+            self._add_clause([lits[n - 1] ^ 1, s[n - 2][k - 1] ^ 1], e)
+
+    def _add_clause(self, lits, e):
+        # Adds a clause at level 0, simplified against what we know there
+        if self._conflict is not None:
+            return
+        simplified = []
+        for lit in dict.fromkeys(lits):
+            value = self._lit_value(lit)
+            if value == 1 or lit ^ 1 in simplified:
+                return  # Already satisfied, or a tautology
+            if value == UNKNOWN:
+                simplified.append(lit)
+
+        if not simplified:
+            eqn_ids = [e] if e != NO_EQN else []
+            self._conflict = self._make_conflict('clash' if e == NO_EQN else 'empty range', eqn_ids, lits)
+        elif len(simplified) == 1:
+            self._enqueue(simplified[0], NO_CLAUSE)
+        else:
+            self._attach(simplified, e, 0.0)
+
+    def _attach(self, lits, e, activity):
+        ci = len(self._clauses)
+        self._clauses.append(lits)
+        self._clause_eqn.append(e)
+        self._clause_activity.append(activity)
+        self._watches[lits[0]].append(ci)
+        self._watches[lits[1]].append(ci)
+        return ci
+
+    def _enqueue(self, lit, reason):
+        v = lit >> 1
+        self._values[v] = 1 - (lit & 1)
+        self._levels[v] = len(self._trail_lim)
+        self._reasons[v] = reason
+        self._trail.append(lit)
+
+    def _propagate(self):
+        # Unit propagation with two watched literals. Returns the index of a conflicting clause, or NO_CLAUSE.
+        values, clauses, watches, trail = self._values, self._clauses, self._watches, self._trail
+        while self._qhead < len(trail):
+            false_lit = trail[self._qhead] ^ 1
+            self._qhead += 1
+            self._stats['propagations'] += 1
+
+            ws = watches[false_lit]
+            kept = []
+            for idx, ci in enumerate(ws):
+                c = clauses[ci]
+                if c is None:
+                    continue
+                # Keep the falsified watch at c[1]
+                if c[0] == false_lit:
+                    c[0], c[1] = c[1], false_lit
+                first = c[0]
+                first_value = values[first >> 1]
+                if first_value != UNKNOWN and first_value ^ (first & 1):
+                    kept.append(ci)
+                    continue
+
+                # Look for another literal that isn't False to watch instead
+                for k in range(2, len(c)):
+                    lit = c[k]
+                    value = values[lit >> 1]
+                    if value == UNKNOWN or value ^ (lit & 1):
+                        c[1], c[k] = lit, false_lit
+                        watches[lit].append(ci)
+                        break
+                else:
+                    kept.append(ci)
+                    if first_value != UNKNOWN:
+                        # Every literal is False
+                        kept.extend(ws[idx + 1:])
+                        watches[false_lit] = kept
+                        self._qhead = len(trail)
+                        return ci
+                    self._enqueue(first, ci)
+            watches[false_lit] = kept
+        return NO_CLAUSE
+
+    def _search(self, conflict_budget):
+        # Searches until a solution (True), proof there is none (False), or conflict_budget conflicts (None)
+        conflicts = 0
+        while True:
+            confl = self._propagate()
+            if confl != NO_CLAUSE:
+                self._stats['conflicts'] += 1
+                conflicts += 1
+                if not self._trail_lim:
+                    self._set_conflict(confl)
+                    return False
+
+                learnt, backtrack_level = self._analyze(confl)
+                self._cancel_until(backtrack_level)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], NO_CLAUSE)
+                else:
+                    ci = self._attach(learnt, NO_EQN, self._clause_inc)
+                    self._learnts.append(ci)
+                    self._stats['learned_total'] += 1
+                    self._enqueue(learnt[0], ci)
+
+                self._var_inc /= VAR_DECAY
+                self._clause_inc /= CLAUSE_DECAY
+            else:
+                if conflicts >= conflict_budget:
+                    self._cancel_until(0)
+                    return None
+                if len(self._learnts) - len(self._trail) >= self._max_learnts:
+                    self._reduce_learnts()
+
+                lit = self._pick_branch()
+                if lit is None:
+                    return True
+                self._stats['decisions'] += 1
+                self._trail_lim.append(len(self._trail))
+                self._enqueue(lit, NO_CLAUSE)
+
+    def _analyze(self, confl):
+        # First-UIP conflict analysis. Returns the learned clause, with the literal to assert first and a literal
+        # from the backtrack level second, and that level.
+        seen, levels, reasons, trail = self._seen, self._levels, self._reasons, self._trail
+        current_level = len(self._trail_lim)
+        learnt = [None]
+        path_count = 0
+        p = None
+        index = len(trail) - 1
+
+        while True:
+            if self._clause_eqn[confl] == NO_EQN:
+                self._bump_clause(confl)
+            c = self._clauses[confl]
+            for q in (c if p is None else c[1:]):
+                v = q >> 1
+                if not seen[v] and levels[v] > 0:
+                    self._bump_var(v)
+                    seen[v] = 1
+                    if levels[v] >= current_level:
+                        path_count += 1
+                    else:
+                        learnt.append(q)
+            # Walk back to the next literal involved at this level
+            while not seen[trail[index] >> 1]:
+                index -= 1
+            p = trail[index]
+            index -= 1
+            confl = reasons[p >> 1]
+            seen[p >> 1] = 0
+            path_count -= 1
+            if path_count == 0:
+                break
+        learnt[0] = p ^ 1
+
+        # Drop literals implied by the rest of the clause through their reason
+        minimized = [learnt[0]]
+        for q in learnt[1:]:
+            reason = reasons[q >> 1]
+            if reason == NO_CLAUSE or any(not seen[r >> 1] and levels[r >> 1] > 0 for r in self._clauses[reason][1:]):
+                minimized.append(q)
+        for q in learnt[1:]:
+            seen[q >> 1] = 0
+        learnt = minimized
+
+        if len(learnt) == 1:
+            return learnt, 0
+        max_i = max(range(1, len(learnt)), key=lambda i: levels[learnt[i] >> 1])
+        learnt[1], learnt[max_i] = learnt[max_i], learnt[1]
+        return learnt, levels[learnt[1] >> 1]
+
+    def _cancel_until(self, level):
+        # Undoes every assignment above the given decision level
+        if len(self._trail_lim) <= level:
+            return
+        values, polarity, reasons, activity = self._values, self._polarity, self._reasons, self._activity
+        trail = self._trail
+        trail_len = self._trail_lim[level]
+        for lit in trail[trail_len:]:
+            v = lit >> 1
+            polarity[v] = values[v]
+            values[v] = UNKNOWN
+            reasons[v] = NO_CLAUSE
+            heapq.heappush(self._heap, (-activity[v], v))
+        del trail[trail_len:]
+        del self._trail_lim[level:]
+        self._qhead = trail_len
+
+    def _pick_branch(self):
+        # The unassigned variable with the highest activity, in its saved phase
+        heap, values, activity = self._heap, self._values, self._activity
+        while heap:
+            neg_activity, v = heapq.heappop(heap)
+            if values[v] == UNKNOWN and -neg_activity == activity[v]:
+                return 2 * v + (0 if self._polarity[v] else 1)
+        # Stale entries may have hidden some; fall back to a scan
+        for v in range(len(values)):
+            if values[v] == UNKNOWN:
+                return 2 * v + (0 if self._polarity[v] else 1)
+        return None
+
+    def _bump_var(self, v):
+        activity = self._activity
+        activity[v] += self._var_inc
+        if activity[v] > RESCALE_LIMIT:
+            for i in range(len(activity)):
+                activity[i] *= 1 / RESCALE_LIMIT
+            self._var_inc *= 1 / RESCALE_LIMIT
+            self._heap = [(-activity[i], i) for i in range(len(activity)) if self._values[i] == UNKNOWN]
+            heapq.heapify(self._heap)
+        elif self._values[v] == UNKNOWN:
+            heapq.heappush(self._heap, (-activity[v], v))
+
+    def _bump_clause(self, ci):
+        clause_activity = self._clause_activity
+        clause_activity[ci] += self._clause_inc
+        if clause_activity[ci] > RESCALE_LIMIT:
+            for i in self._learnts:
+                clause_activity[i] *= 1 / RESCALE_LIMIT
+            self._clause_inc *= 1 / RESCALE_LIMIT
+
+    def _reduce_learnts(self):
+        # Deletes the less active half of the learned clauses, keeping binary ones and those that are currently the
+        # reason for an assignment
+        clauses, reasons = self._clauses, self._reasons
+        self._learnts.sort(key=lambda i: self._clause_activity[i])
+        keep = []
+        half = len(self._learnts) // 2
+        for n, ci in enumerate(self._learnts):
+            c = clauses[ci]
+            locked = reasons[c[0] >> 1] == ci and self._lit_value(c[0]) == 1
+            if n < half and len(c) > 2 and not locked:
+                clauses[ci] = None
+                self._stats['learned_deleted'] += 1
+            else:
+                keep.append(ci)
+        self._learnts = keep
+
+    def _set_conflict(self, confl):
+        e = self._clause_eqn[confl]
+        self._conflict = self._make_conflict('empty range', [e] if e != NO_EQN else [], self._clauses[confl])
+
+    def _make_conflict(self, reason, eqn_ids, lits):
+        lookup = self._symbols.lookup
+        eqns = [[Not(lookup(lit >> 1)) if lit & 1 else lookup(lit >> 1) for lit in self._eqns[e]] for e in eqn_ids]
+        prop = None
+        if reason == 'clash' and lits:
+            prop = lookup(lits[0] >> 1)
+        return Conflict(reason, eqns, prop, eqn_ids)
+
+
+def luby(i):
+    # The i'th (0-based) term of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, ...
+    size, seq = 1, 0
+    while size < i + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != i:
+        size = (size - 1) >> 1
+        seq -= 1
+        i %= size
+    return 2 ** seq
+
+
+"""
+AuxVariable: a variable introduced by the clause encoding of a cardinality equation. Never reported as knowledge.
+"""
+
+
+class AuxVariable:
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __str__(self):
+        return 'aux_{}'.format(self.index)
+
+    def __repr__(self):
+        return str(self)
+
+
+# Reason recorded for assignments that no clause forced
+NO_CLAUSE = -1
+# Equation recorded for clauses that don't come from one
+NO_EQN = -1
+
+# Exactly-one constraints up to this size are encoded pairwise; bigger ones get a sequential counter
+PAIRWISE_LIMIT = 6
+
+# Search tuning, as in MiniSat
+RESTART_BASE = 100
+VAR_DECAY = 0.95
+CLAUSE_DECAY = 0.999
+RESCALE_LIMIT = 1e100
@@ -0,0 +1,270 @@
+# dlx_solver.py: an exact cover engine (Knuth's Algorithm X with dancing links) behind the LogicSolver interface
+
+from array import array
+from logic_solver import SymbolTable, Conflict, eqn_type_bounds
+
+
+class DLXSolver:
+
+    def __init__(self, verbose=False):
+        self._verbose = verbose
+
+        # A problem made only of XOR equations is an exact cover problem: each equation is a column that exactly one
+        # chosen row must cover, and each proposition is a row covering the equations it's in. The True ones in a
+        # solution are the chosen rows.
+        self._symbols = SymbolTable()
+        self._eqns = []  # Member IDs of each equation
+        self._prop_eqns = []  # The equations each proposition is in
+
+        # Facts we were given: True ones are chosen before the search starts, False ones are left out of the matrix
+        self._given = {}
+
+        # The True propositions of the last solution found, as IDs
+        self._solution = None
+        self._conflict = None
+
+        self._stats = {'searches': 0, 'nodes': 0, 'solutions': 0}
+
+    def add_equation(self, proposition_list, eqn_type, count=None):
+        # Adds an equation: only XOR (exactly one of proposition_list True, or 'exactly' with count 1) is an exact
+        # cover constraint, so that's the only kind this solver takes
+        member_ids = [self._intern(prop) for prop in dict.fromkeys(proposition_list)]
+        if eqn_type_bounds(eqn_type, len(member_ids), count) != (1, 1):
+            raise ValueError('DLXSolver only handles xor equations, not {}'.format(eqn_type))
+        e = len(self._eqns)
+        self._eqns.append(member_ids)
+        for prop_id in member_ids:
+            self._prop_eqns[prop_id].append(e)
+
+    def add_true_propositions(self, proposition_list):
+        # Marks all the propositions in the given iterable True in this solver
+        self.add_knowledge({i: True for i in proposition_list})
+
+    def add_false_propositions(self, proposition_list):
+        # Marks all the propositions in the given iterable False in this solver
+        self.add_knowledge({i: False for i in proposition_list})
+
+    def add_knowledge(self, proposition_to_bool_dict):
+        # Marks propositions True and False based on values in given dictionary. A fact contradicting one we already
+        # have is recorded as the conflict.
+        for prop, value in proposition_to_bool_dict.items():
+            prop_id = self._intern(prop)
+            value = 1 if value else 0
+            if self._given.get(prop_id, value) != value and self._conflict is None:
+                self._conflict = Conflict('clash', [], prop, [])
+            self._given[prop_id] = value
+
+    def propagate(self):
+        # There's no propagation as such: this just checks the given facts against each other. Returns a Conflict if
+        # two True facts share an equation (or one fact was given both ways), otherwise None.
+        if self._conflict is None:
+            self._build()
+        return self._conflict
+
+    def solve(self):
+        # Searches for an exact cover extending the given facts. Returns True with the solution in get_knowledge(),
+        # or False if there is none.
+        for solution in self._search():
+            self._solution = solution
+            return True
+        return False
+
+    def count_solutions(self, limit=None):
+        # The number of solutions, counting no further than limit (so count_solutions(2) == 1 says the solution is
+        # unique)
+        count = 0
+        for _ in self._search():
+            count += 1
+            if count == limit:
+                break
+        return count
+
+    def iter_solutions(self):
+        # Yields every solution in turn, as a dict of its True propositions like the first half of get_knowledge()
+        lookup = self._symbols.lookup
+        for solution in self._search():
+            yield {lookup(i): True for i in solution}
+
+    def get_conflict(self):
+        return self._conflict
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    def get_num_sets(self):
+        return len(self._eqns)
+
+    def is_done(self):
+        # If this is True, every proposition has a value
+        return self._solution is not None
+
+    def get_knowledge(self):
+        # Returns (pos_knowledge, neg_knowledge) tuple: the given facts, or after solve() the solution
+        lookup = self._symbols.lookup
+        if self._solution is None:
+            pos_ids = {i for i, value in self._given.items() if value}
+            neg_ids = {i for i, value in self._given.items() if not value}
+        else:
+            pos_ids = set(self._solution)
+            neg_ids = set(range(len(self._symbols))) - pos_ids
+        return {lookup(i): True for i in pos_ids}, {lookup(i): False for i in neg_ids}
+
+    # Internals
+
+    def _intern(self, prop):
+        prop_id = self._symbols.intern(prop)
+        if prop_id == len(self._prop_eqns):
+            self._prop_eqns.append([])
+        return prop_id
+
+    def _build(self):
+        # Lays out the matrix as parallel int arrays of links, one entry per node: node 0 is the root, nodes
+        # 1..columns are the column headers, and the rest are the 1s of the matrix, row by row. Then covers the
+        # columns of the rows given True. Returns (links, the row (proposition ID) of each node, the IDs given True),
+        # where links is (left, right, up, down, column of each node, column sizes), or None if the given facts
+        # contradict each other.
+        num_cols = len(self._eqns)
+        left = array('i', [num_cols] + list(range(num_cols)))
+        right = array('i', list(range(1, num_cols + 1)) + [0])
+        up = array('i', range(num_cols + 1))
+        down = array('i', range(num_cols + 1))
+        col = array('i', range(num_cols + 1))
+        row_of = array('i', [-1] * (num_cols + 1))
+        size = array('i', [0] * (num_cols + 1))
+
+        given_nodes = []
+        for prop_id, eqn_ids in enumerate(self._prop_eqns):
+            if not eqn_ids or self._given.get(prop_id) == 0:
+                continue
+            first = len(col)
+            for k, e in enumerate(eqn_ids):
+                c = e + 1
+                node = first + k
+                left.append(node - 1 if k else first + len(eqn_ids) - 1)
+                right.append(node + 1 if k < len(eqn_ids) - 1 else first)
+                up.append(up[c])
+                down.append(c)
+                down[up[c]] = node
+                up[c] = node
+                col.append(c)
+                row_of.append(prop_id)
+                size[c] += 1
+            if self._given.get(prop_id) == 1:
+                given_nodes.append(first)
+
+        links = (left, right, up, down, col, size)
+        covered = set()
+        for node in given_nodes:
+            j = node
+            while True:
+                if col[j] in covered:
+                    if self._conflict is None:
+                        e = col[j] - 1
+                        self._conflict = Conflict('empty range', [[self._symbols.lookup(i) for i in self._eqns[e]]],
+                                                  None, [e])
+                    return None
+                covered.add(col[j])
+                cover(links, col[j])
+                j = right[j]
+                if j == node:
+                    break
+        return links, row_of, [i for i, value in self._given.items() if value]
+
+    def _search(self):
+        # Algorithm X over a freshly built matrix, yielding each solution as the list of its True proposition IDs.
+        # Iterative, with the chosen row node at each level on a stack, so deep searches don't hit the recursion limit.
+        if self._conflict is not None:
+            return
+        built = self._build()
+        if built is None:
+            return
+        links, row_of, given = built
+        left, right, up, down, col, size = links
+        chosen = []
+        self._stats['searches'] += 1
+
+        if right[0] == 0:
+            self._stats['solutions'] += 1
+            yield list(given)
+            return
+
+        c = choose_column(links)
+        cover(links, c)
+        r = down[c]
+        while True:
+            if r != c:
+                # Try row r at this level
+                self._stats['nodes'] += 1
+                chosen.append(r)
+                j = right[r]
+                while j != r:
+                    cover(links, col[j])
+                    j = right[j]
+                if right[0] != 0:
+                    # Go down a level. An empty column sends us straight back up.
+                    c = choose_column(links)
+                    cover(links, c)
+                    r = down[c]
+                    continue
+                self._stats['solutions'] += 1
+                yield given + [row_of[node] for node in chosen]
+            else:
+                # Column c has no rows left to try: go back up a level
+                uncover(links, c)
+                if not chosen:
+                    return
+
+            # Undo the row chosen at this level and move on to the next one in its column
+            r = chosen.pop()
+            c = col[r]
+            j = left[r]
+            while j != r:
+                uncover(links, col[j])
+                j = left[j]
+            r = down[r]
+
+
+def choose_column(links):
+    # The uncovered column with the fewest rows left (Knuth's S heuristic)
+    right, size = links[1], links[5]
+    best, best_size = 0, None
+    c = right[0]
+    while c != 0:
+        if best_size is None or size[c] < best_size:
+            best, best_size = c, size[c]
+            if best_size <= 1:
+                break
+        c = right[c]
+    return best
+
+
+def cover(links, c):
+    # Takes column c out of the header list, and every row with a 1 in it out of the other columns
+    left, right, up, down, col, size = links
+    left[right[c]] = left[c]
+    right[left[c]] = right[c]
+    i = down[c]
+    while i != c:
+        j = right[i]
+        while j != i:
+            up[down[j]] = up[j]
+            down[up[j]] = down[j]
+            size[col[j]] -= 1
+            j = right[j]
+        i = down[i]
+
+
+def uncover(links, c):
+    # Exactly undoes cover(links, c), in reverse order
+    left, right, up, down, col, size = links
+    i = up[c]
+    while i != c:
+        j = left[i]
+        while j != i:
+            size[col[j]] += 1
+            up[down[j]] = j
+            down[up[j]] = j
+            j = left[j]
+        i = up[i]
+    left[right[c]] = c
+    right[left[c]] = c
@@ -1,17 +1,83 @@
 # logic_solver.py: a propositional logic solving system
 
+import mmap
+import pickle
+import struct
+from array import array
+from time import perf_counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Only needed for propagate_vectorized
+
 
 class LogicSolver:
 
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, pair_reductions=False, triplet_reductions=False):
         self._verbose = verbose
+        # Whether to use subset-based reduction of XOR equations when plain propagation runs dry, and whether to
+        # combine triples of them into new ones when that runs dry too
+        self._pair_reductions = pair_reductions
+        self._triplet_reductions = triplet_reductions
+
+        # Every proposition is interned to a dense int ID the first time we see it; everything below works on IDs
+        self._symbols = SymbolTable()
+
+        # Per-proposition state, indexed by ID: the known value (UNKNOWN, 0 or 1), its position on the trail, and the
+        # equation that forced it (or NO_EQN for facts we were given)
+        self._values = array('b')
+        self._trail_pos = array('i')
+        self._reasons = array('i')
+
+        # Equation members are literals: 2*ID for the proposition itself, 2*ID+1 for Not(proposition). The occurrence
+        # index lists, for each literal, the equations that contain it.
+        self._lit_index = []
+
+        # Equation store. Members of equation e are _eqn_members[_eqn_start[e]:_eqn_start[e+1]]. For each equation
+        # we keep the number of members whose value hasn't been applied yet, and the bounds [lo, hi] on how many of
+        # those must still be True. The bounds aren't clamped to [0, unknown] as facts come in, so applying a fact is
+        # a couple of subtractions and undoing it is the same additions.
+        self._eqn_members = array('i')
+        self._eqn_start = array('i', [0])
+        self._eqn_unknown = array('i')
+        self._eqn_lo = array('i')
+        self._eqn_hi = array('i')
+        # Number of unapplied members each equation had when pair/triplet reduction last examined it (-1 if never)
+        self._eqn_paired_unknown = array('i')
+        self._eqn_tripled_unknown = array('i')
+        # Canonical keys (frozensets of member literals) of the equations triplet reduction has derived, and which
+        # equations those are. Derived equations aren't combined any further, or they'd multiply without end.
+        self._derived_keys = set()
+        self._eqn_derived = bytearray()
+
+        # The trail: every known proposition ID, in the order we learned it. Everything before _qhead has been
+        # applied to the equations; everything after it is the propagation queue.
+        self._trail = []
+        self._qhead = 0
+
+        # Set the moment we find out the equations can't all hold; propagation stops there
+        self._conflict = None
+
+        # (equation count, rows, cols, negated) of the compiled incidence matrix for propagate_vectorized
+        self._incidence = None
 
-        self._prop_eqns = []
-        self._knowledge = {}
+        self._stats = {'pair_passes': 0, 'pair_time': 0.0, 'pair_eqns_examined': 0, 'pair_facts': 0,
+                       'triplet_passes': 0, 'triplet_time': 0.0, 'triplet_eqns_examined': 0, 'triplet_eqns_added': 0,
+                       'decisions': 0}
 
-    def add_equation(self, proposition_list, eqn_type):
-        # Adds an equation: the propositions in proposition_list will be related by the relation _type_ (XOR, OR, etc)
-        self._prop_eqns.append(PropositionEqn(set(proposition_list), eqn_type))
+        # Per-stage metrics (see enable_metrics), and the tracer told about each stage and search step as it happens.
+        # Both are off (None) unless asked for, and then cost one check per stage rather than anything per fact.
+        self._metrics = None
+        self._tracer = None
+
+    def add_equation(self, proposition_list, eqn_type, count=None):
+        # Adds an equation: the propositions in proposition_list will be related by the relation _type_ (XOR, OR, etc).
+        # The 'atleast', 'atmost' and 'exactly' types bound the number of true propositions by count. A member may
+        # be given as Not(prop), which counts as True when prop is False.
+        member_lits = [self._literal(prop) for prop in dict.fromkeys(proposition_list)]
+        lo, hi = eqn_type_bounds(eqn_type, len(member_lits), count)
+        self._add_eqn(member_lits, lo, hi)
 
     def add_true_propositions(self, proposition_list):
         # Marks all the propositions in the given iterable True in this solver
@@ -22,63 +88,876 @@ class LogicSolver:
         self.add_knowledge({i: False for i in proposition_list})
 
     def add_knowledge(self, proposition_to_bool_dict):
-        # Marks propositions True and False based on values in given dictionary
-        # TODO: check for contradiction with previously known things here
-        self._knowledge.update(proposition_to_bool_dict)
+        # Marks propositions True and False based on values in given dictionary. Only facts we didn't already have are
+        # queued for propagation. A fact contradicting one we already have is recorded as the conflict.
+        for prop, value in proposition_to_bool_dict.items():
+            lit = self._literal(prop)
+            self._assign(lit >> 1, (1 if value else 0) ^ (lit & 1), NO_EQN)
+
+    def _add_eqn(self, member_lits, lo, hi, derived=False):
+        e = len(self._eqn_unknown)
+        if not isinstance(self._eqn_members, array):
+            # Still reading the members from a template's read-only views: take our own copy to add to
+            self._eqn_members = int_array(self._eqn_members)
+            self._eqn_start = int_array(self._eqn_start)
+        self._eqn_members.extend(member_lits)
+        self._eqn_start.append(len(self._eqn_members))
+        self._eqn_unknown.append(len(member_lits))
+        self._eqn_lo.append(lo)
+        self._eqn_hi.append(hi)
+        self._eqn_paired_unknown.append(-1)
+        self._eqn_tripled_unknown.append(-1)
+        self._eqn_derived.append(1 if derived else 0)
+        for lit in member_lits:
+            self._lit_index[lit].append(e)
+
+        # Facts that were already applied before this equation existed won't come around again, so account for
+        # them now
+        values = self._values
+        for lit in member_lits:
+            if self._is_applied(lit >> 1):
+                self._eqn_unknown[e] -= 1
+                if values[lit >> 1] ^ (lit & 1):
+                    self._eqn_lo[e] -= 1
+                    self._eqn_hi[e] -= 1
+
+        self._check_eqn(e)
 
     def run_iter(self):
-        # The magic: run a turn on this solver.
-        # Stop after first type of inference that allows new insights. This way, we can avoid the expensive later
-        # kinds whenever possible.
-
-        # Step 0: transform/reduce sets from previous info
-        print('Step 0 (apply previous discoveries)')
-        for datum, knownValue in self._knowledge.items():
-            for s in self._prop_eqns:
-                s.apply_information(datum, knownValue)
-
-        # Can we make any new inferences from this?
-        new_inferences = gather_all_inferences(self._prop_eqns)
-
-        # # Step 1: transformations based on comparing pairs of sets (subset-based reduction)
-        # if len(new_inferences) == 0:  # Only if no discoveries so far
-        #     print('Step 1 (subset-reduction)')
-        #     new_inferences, self._prop_eqns = pair_reductions(self._prop_eqns)
-        #
-        # # Step 2: adding sets using combining inference rules (under certain conditions)
-        # if len(new_inferences) == 0:  # Only if no discoveries so far
-        #     print('Step 2 (triple-set combining)')
-        #     new_inferences, self._prop_eqns = triplet_reductions(self._prop_eqns)
-
-        # Update things known
-        self.add_knowledge(new_inferences)
-
-        # Wrap-up: are there any depleted sets we must clean up?
-        self._prop_eqns = [s for s in self._prop_eqns if s.still_has_info()]
+        # The magic: run a turn on this solver: apply the facts queued since last time. Whatever they let us infer
+        # is queued in turn for the next one.
+        # Returns the Conflict if one was found (now or before), otherwise None.
+
+        # Step 0: transform/reduce equations from the facts queued since last time
+        # Only the equations that actually contain a proposition need to hear about it.
+        self._run_stage('apply', self._apply_queued, len(self._trail))
+
+        # Step 1: transformations based on comparing pairs of sets (subset-based reduction)
+        if self._pair_reductions and self._conflict is None and self._qhead == len(self._trail):
+            self._run_stage('pair_reduce', self._pair_reduce)
+
+        # Step 2: adding sets using combining inference rules (under certain conditions)
+        if self._triplet_reductions and self._conflict is None and self._qhead == len(self._trail):
+            self._run_stage('triplet_reduce', self._triplet_reduce)
 
         # Done with this iteration
+        return self.get_conflict()
+
+    def propagate(self):
+        # Runs turns until the propagation queue is empty and the last turn derived no new equations, i.e. nothing
+        # more follows from what we know, or until we hit a contradiction. Returns the Conflict in the latter case,
+        # otherwise None.
+        while self._conflict is None:
+            eqn_count = len(self._eqn_unknown)
+            self.run_iter()
+            if self._qhead == len(self._trail) and len(self._eqn_unknown) == eqn_count:
+                break
+        return self.get_conflict()
+
+    def propagate_vectorized(self):
+        # The same fixpoint as propagate() without the reduction stages, computed in bulk with NumPy over the
+        # equations x propositions incidence matrix. Each round counts the known-True and the unknown members of
+        # every equation with two sparse matrix-vector products, finds the equations whose remaining members must now
+        # be all True (AND) or all False (NOR), and assigns those members all at once. Returns the Conflict if one is
+        # found, otherwise None. A negated member counts as True when its proposition is False.
+        if np is None:
+            raise ImportError('propagate_vectorized needs NumPy')
+        if self._conflict is None:
+            self._run_stage('vectorized', self._propagate_vectorized)
+        return self.get_conflict()
+
+    def _propagate_vectorized(self):
+        rows, cols, negated = self._incidence_matrix()
+        eqn_count = len(self._eqn_unknown)
+        values = np.frombuffer(self._values, dtype=np.int8)
+        trail_pos = np.frombuffer(self._trail_pos, dtype=np.intc)
+        reasons = np.frombuffer(self._reasons, dtype=np.intc)
+
+        # The bounds as added: the counters plus the True facts already applied to them
+        applied = np.zeros(len(values), dtype=bool)
+        applied[np.array(self._trail[:self._qhead], dtype=np.intp)] = True
+        applied_trues = np.bincount(rows, weights=applied[cols] & (values[cols] != negated), minlength=eqn_count)
+        lo_added = np.frombuffer(self._eqn_lo, dtype=np.intc) + applied_trues.astype(np.intc)
+        hi_added = np.frombuffer(self._eqn_hi, dtype=np.intc) + applied_trues.astype(np.intc)
+
+        while True:
+            member_values = values[cols]
+            unknown = member_values == UNKNOWN
+            true_members = ~unknown & (member_values != negated)
+            trues = np.bincount(rows, weights=true_members, minlength=eqn_count).astype(np.intc)
+            unknowns = np.bincount(rows, weights=unknown, minlength=eqn_count).astype(np.intc)
+            lo = np.maximum(lo_added - trues, 0)
+            hi = np.minimum(hi_added - trues, unknowns)
+
+            contradictory = np.flatnonzero(lo > hi)
+            if contradictory.size:
+                self._conflict = ('empty range', [int(contradictory[0])], None)
+                break
+
+            # Scatter back: the unknown members of the equations that collapsed, turned into proposition values
+            lits_true = unknown & ((unknowns > 0) & (lo == unknowns))[rows]
+            lits_false = unknown & ((unknowns > 0) & (hi == 0))[rows]
+            to_true = (lits_true & ~negated) | (lits_false & negated)
+            to_false = (lits_false & ~negated) | (lits_true & negated)
+            if not to_true.any() and not to_false.any():
+                break
+            props_true, first_true = np.unique(cols[to_true], return_index=True)
+            props_false, first_false = np.unique(cols[to_false], return_index=True)
+            reasons_true = rows[to_true][first_true]
+            reasons_false = rows[to_false][first_false]
+
+            clashes = np.intersect1d(props_true, props_false)
+            if clashes.size:
+                prop_id = int(clashes[0])
+                eqn_ids = [int(reasons_true[np.searchsorted(props_true, prop_id)]),
+                           int(reasons_false[np.searchsorted(props_false, prop_id)])]
+                self._conflict = ('clash', eqn_ids, prop_id)
+                break
+
+            for props, prop_reasons, value in ((props_true, reasons_true, 1), (props_false, reasons_false, 0)):
+                values[props] = value
+                reasons[props] = prop_reasons
+                trail_pos[props] = np.arange(len(self._trail), len(self._trail) + len(props))
+                self._trail.extend(props.tolist())
+
+        # Everything on the trail is now accounted for; bring the scalar counters in line with it
+        self._eqn_unknown = array('i', unknowns.tobytes())
+        self._eqn_lo = array('i', (lo_added - trues).tobytes())
+        self._eqn_hi = array('i', (hi_added - trues).tobytes())
+        self._qhead = len(self._trail)
+
+    def solve(self, heuristic=None):
+        # Search for an assignment satisfying every equation: propagate, then repeatedly assume a value for some
+        # proposition (as picked by heuristic, see mrv_branching) and propagate that, undoing assumptions off the
+        # trail when they lead to a contradiction. Returns True with the solution in get_knowledge(), or False if
+        # there is none.
+        for _ in self._search(heuristic):
+            return True
+        return False
+
+    def count_solutions(self, limit=None, heuristic=None):
+        # The number of assignments to the propositions satisfying every equation, counting no further than limit:
+        # count_solutions(2) == 1 says the solution is unique, and stops at the second one. The same search as
+        # solve(), carrying on past each solution as if it had been a contradiction. Afterwards the solver keeps what
+        # propagation found before the search started, and none of the facts assumed or found during it.
+        if not self._propagate_all(self._triplet_reductions):
+            return 0
+        trail_len = len(self._trail)
+        count = 0
+        for free in self._search(heuristic):
+            # Every equation is satisfied whatever the propositions still unknown are
+            count += 2 ** free
+            if limit is not None and count >= limit:
+                count = limit
+                break
+        self._backtrack(trail_len)
+        return count
+
+    def get_conflict(self):
+        # Returns a Conflict describing the contradiction we've run into, or None if there hasn't been one
+        if self._conflict is None:
+            return None
+        reason, eqn_ids, prop_id = self._conflict
+        eqns = [[self._lit_prop(lit) for lit in self._eqn_members[self._eqn_start[e]:self._eqn_start[e + 1]]]
+                for e in eqn_ids]
+        prop = self._symbols.lookup(prop_id) if prop_id is not None else None
+        return Conflict(reason, eqns, prop, eqn_ids)
+
+    def get_stats(self):
+        # Counters and timings for the reduction stages, and the number of assumptions made searching
+        return dict(self._stats)
+
+    def enable_metrics(self):
+        # Starts keeping per-stage metrics for get_metrics(). Each propagation stage ('apply', 'pair_reduce',
+        # 'triplet_reduce', 'vectorized') counts its calls, time (in seconds), facts_applied, eqns_touched (by those
+        # facts), inferences (facts it found), eqns_added and contradictions; 'search' counts decisions, backtracks
+        # and solutions.
+        if self._metrics is None:
+            self._metrics = {stage: dict.fromkeys(STAGE_COUNTERS, 0) for stage in PROPAGATION_STAGES}
+            for counters in self._metrics.values():
+                counters['time'] = 0.0
+            self._metrics['search'] = {'decisions': 0, 'backtracks': 0, 'solutions': 0}
+
+    def set_tracer(self, tracer):
+        # Calls tracer(event, data) as things happen, or stops if tracer is None. The events are the stage names
+        # after each run of a stage, with data holding that run's metrics, and 'decision' (prop, value, depth),
+        # 'backtrack' (depth) and 'solution' (free, the number of propositions left unknown) during the search.
+        # Turns metrics on too.
+        self._tracer = tracer
+        if tracer is not None:
+            self.enable_metrics()
+
+    def get_metrics(self):
+        # The metrics kept since enable_metrics(), by stage (empty if they're off)
+        if self._metrics is None:
+            return {}
+        return {stage: dict(counters) for stage, counters in self._metrics.items()}
 
     def get_num_sets(self):
-        return len(self._prop_eqns)
+        return sum(1 for e in range(len(self._eqn_unknown)) if self._eqn_has_info(e))
 
     def is_done(self):
         # If this is True, no point to further iterations
-        return len(self._prop_eqns) == 0
+        return self.get_num_sets() == 0
 
     def get_knowledge(self):
         # Returns (pos_knowledge, neg_knowledge) tuple of all things we know so far
-        pos_knowledge = {k: v for k, v in self._knowledge.items() if v}
-        neg_knowledge = {k: v for k, v in self._knowledge.items() if not v}
+        lookup = self._symbols.lookup
+        values = self._values
+        pos_knowledge = {lookup(i): True for i in self._trail if values[i]}
+        neg_knowledge = {lookup(i): False for i in self._trail if not values[i]}
         return pos_knowledge, neg_knowledge
 
+    def get_equations(self):
+        # Returns a PropositionEqn for each equation that still carries information, over the members whose values
+        # haven't been applied to it yet. For inspection; changing them doesn't affect the solver.
+        eqns = []
+        for e in range(len(self._eqn_unknown)):
+            if self._eqn_has_info(e):
+                lo, hi = self._eqn_bounds(e)
+                eqns.append(PropositionEqn.from_bounds([self._lit_prop(lit) for lit in self._eqn_unapplied_members(e)],
+                                                       lo, hi))
+        return eqns
+
+    def compile(self, fingerprint=None):
+        # Freezes this solver's model into a ModelTemplate, from which from_template() stamps out solvers just like
+        # this one without adding the equations again. The facts known so far go in too: typically those the
+        # equations force by themselves, such as the only member of a one-member XOR. fingerprint (bytes) is kept
+        # with the template for its users to check that it's the model they want, when it was built for one
+        # particular input.
+        if self._conflict is not None:
+            raise ValueError('A solver with a conflict cannot be compiled into a template')
+        # The occurrence index goes in flat: the equations containing literal l are
+        # lit_eqns[lit_start[l]:lit_start[l+1]]
+        lit_start, lit_eqns = array('i', [0]), array('i')
+        for eqns in self._lit_index:
+            lit_eqns.extend(eqns)
+            lit_start.append(len(lit_eqns))
+        buffers = {'eqn_members': self._eqn_members, 'eqn_start': self._eqn_start, 'eqn_unknown': self._eqn_unknown,
+                   'eqn_lo': self._eqn_lo, 'eqn_hi': self._eqn_hi, 'lit_start': lit_start, 'lit_eqns': lit_eqns,
+                   'trail_pos': self._trail_pos, 'reasons': self._reasons, 'trail': array('i', self._trail),
+                   'values': self._values, 'eqn_derived': self._eqn_derived}
+        views = {name: memoryview(bytes(memoryview(buffer).cast('B'))).cast(typecode)
+                 for name, typecode in ModelTemplate.FIELDS for buffer in [buffers[name]]}
+        return ModelTemplate(self._symbols.copy(), views, self._qhead, frozenset(self._derived_keys), fingerprint)
+
+    @classmethod
+    def from_template(cls, template, verbose=False, pair_reductions=False, triplet_reductions=False):
+        # A solver in the state of the one the template was compiled from. Only the count arrays, the per-proposition
+        # state and the occurrence index are copied: no equation is rebuilt and no proposition hashed. The members
+        # themselves are read straight from the template until an equation is added.
+        solver = cls(verbose, pair_reductions, triplet_reductions)
+        solver._symbols = template.symbols.copy()
+        solver._values = array('b')
+        solver._values.frombytes(template.values.cast('B'))
+        solver._trail_pos = int_array(template.trail_pos)
+        solver._reasons = int_array(template.reasons)
+        lit_start, lit_eqns = template.lit_start, template.lit_eqns
+        solver._lit_index = [lit_eqns[lit_start[lit]:lit_start[lit + 1]].tolist() for lit in range(len(lit_start) - 1)]
+
+        solver._eqn_members = template.eqn_members
+        solver._eqn_start = template.eqn_start
+        solver._eqn_unknown = int_array(template.eqn_unknown)
+        solver._eqn_lo = int_array(template.eqn_lo)
+        solver._eqn_hi = int_array(template.eqn_hi)
+        eqn_count = len(solver._eqn_unknown)
+        solver._eqn_paired_unknown = array('i', [-1]) * eqn_count
+        solver._eqn_tripled_unknown = array('i', [-1]) * eqn_count
+        solver._derived_keys = set(template.derived_keys)
+        solver._eqn_derived = bytearray(template.eqn_derived)
+
+        solver._trail = template.trail.tolist()
+        solver._qhead = template.qhead
+        return solver
+
+    # Internals: everything below works on interned IDs and literals
+
+    def _incidence_matrix(self):
+        # The equations x propositions incidence matrix in coordinate form: equation rows[k] contains proposition
+        # cols[k], negated if negated[k]. Compiled once for a given set of equations.
+        eqn_count = len(self._eqn_unknown)
+        if self._incidence is None or self._incidence[0] != eqn_count:
+            sizes = np.diff(np.frombuffer(self._eqn_start, dtype=np.intc))
+            rows = np.repeat(np.arange(eqn_count, dtype=np.intp), sizes)
+            lits = np.frombuffer(self._eqn_members, dtype=np.intc)
+            self._incidence = (eqn_count, rows, (lits >> 1).astype(np.intp), (lits & 1).astype(bool))
+        return self._incidence[1:]
+
+    def _run_stage(self, stage, method, *args):
+        # Runs a propagation stage, method(*args), and returns what it does. With metrics on, also measures what the
+        # run did, adds that to the stage's metrics and tells the tracer.
+        if self._metrics is None:
+            return method(*args)
+        qhead, trail_len, eqn_count = self._qhead, len(self._trail), len(self._eqn_unknown)
+        had_conflict = self._conflict is not None
+        t_start = perf_counter()
+        result = method(*args)
+        elapsed = perf_counter() - t_start
+
+        lit_index = self._lit_index
+        applied = self._trail[qhead:self._qhead]
+        touched = sum(len(lit_index[2 * prop_id]) + len(lit_index[2 * prop_id + 1]) for prop_id in applied)
+        data = {'time': elapsed, 'facts_applied': len(applied), 'eqns_touched': touched,
+                'inferences': len(self._trail) - trail_len, 'eqns_added': len(self._eqn_unknown) - eqn_count,
+                'contradictions': 1 if self._conflict is not None and not had_conflict else 0}
+        counters = self._metrics[stage]
+        counters['calls'] += 1
+        for name, value in data.items():
+            counters[name] += value
+        if self._tracer is not None:
+            self._tracer(stage, data)
+        return result
+
+    def _trace_search(self, event, data):
+        # Counts a search step in the metrics and tells the tracer, if they're on
+        if self._metrics is not None:
+            self._metrics['search'][event + 's'] += 1
+            if self._tracer is not None:
+                self._tracer(event, data)
+
+    def _apply_queued(self, turn_end):
+        # Applies queued facts up to trail position turn_end, stopping early on a conflict
+        while self._qhead < turn_end and self._conflict is None:
+            prop_id = self._trail[self._qhead]
+            self._qhead += 1
+            self._apply_fact(prop_id)
+
+    def _propagate_all(self, triplet_reductions=False):
+        # propagate() without the per-turn reporting, for the search. Returns False on a conflict.
+        while self._conflict is None:
+            self._run_stage('apply', self._apply_queued, len(self._trail))
+            if self._pair_reductions and self._conflict is None:
+                self._run_stage('pair_reduce', self._pair_reduce)
+            if triplet_reductions and self._conflict is None and self._qhead == len(self._trail):
+                if self._run_stage('triplet_reduce', self._triplet_reduce):
+                    continue
+            if self._qhead == len(self._trail):
+                break
+        return self._conflict is None
+
+    def _search(self, heuristic):
+        # The search behind solve() and count_solutions(). Yields each time every equation is satisfied, with the
+        # number of propositions still unknown; resuming it moves on to the next alternative. Sibling branches share
+        # everything propagated before the assumption they differ in, as it stays on the trail.
+        if heuristic is None:
+            heuristic = mrv_branching
+
+        # Triplet reduction only runs here, before any assumptions: the equations it derives only hold given the
+        # facts in force when it ran
+        ok = self._propagate_all(self._triplet_reductions)
+
+        # One entry per assumption in force: (trail length before it, proposition ID, whether it's the second value
+        # we're trying)
+        decisions = []
+        while True:
+            if ok:
+                choice = heuristic(self)
+                if choice is None:
+                    # Nothing left that isn't satisfied
+                    free = len(self._values) - len(self._trail)
+                    self._trace_search('solution', {'free': free})
+                    yield free
+                    ok = False
+                else:
+                    prop_id, value = choice
+                    self._stats['decisions'] += 1
+                    if self._metrics is not None:
+                        self._trace_search('decision', {'prop': self._symbols.lookup(prop_id), 'value': bool(value),
+                                                        'depth': len(decisions)})
+                    decisions.append((len(self._trail), prop_id, False))
+                    self._assign(prop_id, value, NO_EQN)
+                    ok = self._propagate_all()
+
+            if not ok:
+                # Undo assumptions until we find one whose other value we haven't tried
+                while decisions:
+                    trail_len, prop_id, is_second_try = decisions.pop()
+                    value = self._values[prop_id]
+                    self._backtrack(trail_len)
+                    self._trace_search('backtrack', {'depth': len(decisions)})
+                    if not is_second_try:
+                        decisions.append((trail_len, prop_id, True))
+                        self._assign(prop_id, 1 - value, NO_EQN)
+                        break
+                else:
+                    return
+                ok = self._propagate_all()
+
+    def _pair_reduce(self):
+        # If XOR equation A's remaining members are a proper subset of XOR equation B's, A's True member is in B too,
+        # so every member of B outside A is False (members being literals, that holds for negated ones too). We only
+        # start from equations whose remaining members changed since they were last examined, and count shared members
+        # through the occurrence index to find the equations they overlap, so an unchanged pair is never compared twice.
+        t_start = perf_counter()
+        trail_len = len(self._trail)
+        eqn_unknown, examined = self._eqn_unknown, self._eqn_paired_unknown
+        candidates = [e for e in range(len(eqn_unknown)) if eqn_unknown[e] != examined[e] and self._eqn_is_xor(e)]
+
+        for a in candidates:
+            if self._conflict is not None:
+                break
+            examined[a] = eqn_unknown[a]
+            members_a = self._eqn_unapplied_members(a)
+            shared_counts = {}
+            for lit in members_a:
+                for b in self._lit_index[lit]:
+                    shared_counts[b] = shared_counts.get(b, 0) + 1
+
+            size_a = len(members_a)
+            for b, shared in shared_counts.items():
+                if b == a or not self._eqn_is_xor(b):
+                    continue
+                size_b = eqn_unknown[b]
+                if shared == size_a and size_b > size_a:
+                    self._falsify_outside(b, set(members_a))
+                elif shared == size_b and size_a > size_b:
+                    self._falsify_outside(a, set(self._eqn_unapplied_members(b)))
+
+        self._stats['pair_passes'] += 1
+        self._stats['pair_time'] += perf_counter() - t_start
+        self._stats['pair_eqns_examined'] += len(candidates)
+        self._stats['pair_facts'] += len(self._trail) - trail_len
+
+    def _triplet_reduce(self):
+        # A theorem on XOR sets: if we have two disjoint XOR sets A and C such that all elements of another set B are
+        # in one or the other, then (A union C) - B is an XOR set too: A and C hold two True propositions between them
+        # and B holds exactly one of those. This is equivalent to some kinds of advanced reasoning used by humans in
+        # Sudoku (X-wings and other fish).
+        # Only triples involving an equation whose remaining members changed since the last pass are considered.
+        # Candidate As and Cs come from the occurrence index, and derived sets are keyed by their members so the
+        # same one is never added twice. Returns the number of equations added.
+        t_start = perf_counter()
+        eqn_unknown, examined = self._eqn_unknown, self._eqn_tripled_unknown
+        changed = [e for e in range(len(eqn_unknown))
+                   if eqn_unknown[e] != examined[e] and not self._eqn_derived[e] and self._eqn_is_xor(e)]
+        member_sets = {}
+        derived = {}
+        for e in changed:
+            examined[e] = eqn_unknown[e]
+        for e in changed:
+            # e as B, then e as A (which covers e as C too, the two being interchangeable)
+            self._find_triplets(e, None, member_sets, derived)
+            for b in self._overlapping_xors(e):
+                self._find_triplets(b, e, member_sets, derived)
+
+        for key in derived:
+            self._add_eqn(sorted(key), 1, 1, derived=True)
+
+        self._stats['triplet_passes'] += 1
+        self._stats['triplet_time'] += perf_counter() - t_start
+        self._stats['triplet_eqns_examined'] += len(changed)
+        self._stats['triplet_eqns_added'] += len(derived)
+        return len(derived)
+
+    def _find_triplets(self, b, a, member_sets, derived):
+        # Finds (A, B, C) triples for B = equation b (and A = equation a, if given) and records the derived sets
+        set_b = self._xor_member_set(b, member_sets)
+        for a in (self._overlapping_xors(b) if a is None else (a,)):
+            if a == b:
+                continue
+            set_a = self._xor_member_set(a, member_sets)
+            # C must hold the rest of B, and not overlap A
+            rest_of_b = set_b - set_a
+            if not rest_of_b or len(rest_of_b) == len(set_b):
+                continue
+            pivot = min(rest_of_b, key=lambda lit: len(self._lit_index[lit]))
+            for c in self._lit_index[pivot]:
+                if c == a or c == b or self._eqn_derived[c] or not self._eqn_is_xor(c):
+                    continue
+                set_c = self._xor_member_set(c, member_sets)
+                if rest_of_b <= set_c and set_a.isdisjoint(set_c):
+                    key = (set_a | set_c) - set_b
+                    if key not in self._derived_keys and key != set_a and key != set_c:
+                        self._derived_keys.add(key)
+                        derived[key] = None
+
+    def _xor_member_set(self, e, member_sets):
+        members = member_sets.get(e)
+        if members is None:
+            members = member_sets[e] = frozenset(self._eqn_unapplied_members(e))
+        return members
+
+    def _overlapping_xors(self, e):
+        # XOR equations sharing a remaining member with equation e
+        overlapping = set()
+        for lit in self._eqn_unapplied_members(e):
+            overlapping.update(self._lit_index[lit])
+        overlapping.discard(e)
+        return [o for o in overlapping if not self._eqn_derived[o] and self._eqn_is_xor(o)]
+
+    def _falsify_outside(self, e, subset_members):
+        # Marks every remaining member of equation e that isn't in subset_members False
+        for lit in self._eqn_unapplied_members(e):
+            if lit not in subset_members and not self._assign(lit >> 1, lit & 1, e):
+                return
+
+    def _eqn_is_xor(self, e):
+        # Exactly one of the equation's remaining members must be True
+        return self._eqn_lo[e] == 1 and self._eqn_bounds(e) == (1, 1)
+
+    def _backtrack(self, trail_len):
+        # Forgets every fact learned after the first trail_len, undoing their effect on the equations, and clears
+        # any conflict they led to
+        values, trail = self._values, self._trail
+        eqn_unknown, eqn_lo, eqn_hi = self._eqn_unknown, self._eqn_lo, self._eqn_hi
+        while len(trail) > trail_len:
+            prop_id = trail.pop()
+            if len(trail) < self._qhead:
+                truth_value = values[prop_id]
+                for lit_eqns, lit_value in ((self._lit_index[2 * prop_id], truth_value),
+                                            (self._lit_index[2 * prop_id + 1], 1 - truth_value)):
+                    for e in lit_eqns:
+                        eqn_unknown[e] += 1
+                        if lit_value:
+                            eqn_lo[e] += 1
+                            eqn_hi[e] += 1
+            values[prop_id] = UNKNOWN
+            self._reasons[prop_id] = NO_EQN
+        self._qhead = min(self._qhead, trail_len)
+        self._conflict = None
+
+    def _intern(self, prop):
+        prop_id = self._symbols.intern(prop)
+        if prop_id == len(self._values):
+            self._values.append(UNKNOWN)
+            self._trail_pos.append(0)
+            self._reasons.append(NO_EQN)
+            self._lit_index.append([])
+            self._lit_index.append([])
+        return prop_id
+
+    def _literal(self, prop):
+        # The literal for an equation member or knowledge key: Not(p) becomes p's literal with the low bit set
+        negated = 0
+        while isinstance(prop, Not):
+            prop = prop.prop
+            negated ^= 1
+        return 2 * self._intern(prop) + negated
+
+    def _lit_prop(self, lit):
+        prop = self._symbols.lookup(lit >> 1)
+        return Not(prop) if lit & 1 else prop
+
+    def _assign(self, prop_id, value, reason):
+        # Records a fact forced by equation reason (or given, for NO_EQN) and queues it for propagation, unless we
+        # knew it already. Returns False if it contradicts what we knew.
+        if self._values[prop_id] == UNKNOWN:
+            self._values[prop_id] = value
+            self._trail_pos[prop_id] = len(self._trail)
+            self._reasons[prop_id] = reason
+            self._trail.append(prop_id)
+        elif self._values[prop_id] != value:
+            if self._conflict is None:
+                eqn_ids = [e for e in (self._reasons[prop_id], reason) if e != NO_EQN]
+                self._conflict = ('clash', eqn_ids, prop_id)
+            return False
+        return True
+
+    def _is_applied(self, prop_id):
+        # Whether the proposition's value is known and has been applied to its equations
+        return self._values[prop_id] != UNKNOWN and self._trail_pos[prop_id] < self._qhead
+
+    def _eqn_bounds(self, e):
+        # Bounds on the number of unapplied members that must be True, clamped to what's possible
+        return max(self._eqn_lo[e], 0), min(self._eqn_hi[e], self._eqn_unknown[e])
+
+    def _eqn_has_info(self, e):
+        # An equation that any assignment of its remaining members satisfies may be ignored without loss of information
+        unknown = self._eqn_unknown[e]
+        return unknown > 0 and (self._eqn_lo[e] > 0 or self._eqn_hi[e] < unknown)
+
+    def _eqn_unapplied_members(self, e):
+        # Member literals whose values haven't been applied to this equation yet: unknown ones and those still queued
+        return [lit for lit in self._eqn_members[self._eqn_start[e]:self._eqn_start[e + 1]]
+                if not self._is_applied(lit >> 1)]
+
+    def _apply_fact(self, prop_id):
+        # Applies a known value to every equation containing the proposition, or its negation
+        value = self._values[prop_id]
+        eqn_unknown, eqn_lo, eqn_hi = self._eqn_unknown, self._eqn_lo, self._eqn_hi
+        for lit_eqns, truth_value in ((self._lit_index[2 * prop_id], value),
+                                      (self._lit_index[2 * prop_id + 1], 1 - value)):
+            for e in lit_eqns:
+                # Was this equation already forcing its remaining members before? Then they're all assigned already.
+                unknown = eqn_unknown[e]
+                lo, hi = eqn_lo[e], eqn_hi[e]
+                was_forced = lo >= unknown or hi <= 0
+
+                unknown -= 1
+                eqn_unknown[e] = unknown
+                if truth_value:
+                    lo -= 1
+                    hi -= 1
+                    eqn_lo[e] = lo
+                    eqn_hi[e] = hi
+
+                # Once there's a conflict we only finish the bookkeeping for this fact
+                if self._conflict is not None:
+                    continue
+                if not was_forced and (lo >= unknown or hi <= 0):
+                    self._check_eqn(e)
+                elif max(lo, 0) > min(hi, unknown):
+                    self._conflict = ('empty range', [e], None)
+
+    def _check_eqn(self, e):
+        # If the equation has collapsed to either an AND or a NOR over its remaining members, we can infer the values
+        # of everything left
+        lo, hi = self._eqn_bounds(e)
+        if lo > hi:
+            if self._conflict is None:
+                self._conflict = ('empty range', [e], None)
+            return
+        unknown = self._eqn_unknown[e]
+        if unknown == 0 or (lo != unknown and hi != 0):
+            return
+        value = 1 if lo == unknown else 0
+        values = self._values
+        for lit in self._eqn_members[self._eqn_start[e]:self._eqn_start[e + 1]]:
+            prop_id, prop_value = lit >> 1, value ^ (lit & 1)
+            # Members that are known but still queued count too: if one disagrees, that's a clash
+            if values[prop_id] == UNKNOWN or (values[prop_id] != prop_value and not self._is_applied(prop_id)):
+                if not self._assign(prop_id, prop_value, e):
+                    return
+
+
+def mrv_branching(solver):
+    # Default branching heuristic for LogicSolver.solve: find the equation with the fewest unknown members that
+    # still carries information (minimum remaining values), and assume its first unknown member True (so a negated
+    # member's proposition False).
+    # Returns (proposition ID, value), or None if every equation is satisfied.
+    eqn_unknown, eqn_lo, eqn_hi = solver._eqn_unknown, solver._eqn_lo, solver._eqn_hi
+    best_eqn, best_unknown = None, None
+    for e in range(len(eqn_unknown)):
+        unknown = eqn_unknown[e]
+        if unknown > 0 and (eqn_lo[e] > 0 or eqn_hi[e] < unknown) and (best_eqn is None or unknown < best_unknown):
+            best_eqn, best_unknown = e, unknown
+            if unknown <= 2:
+                break  # Can't do better than a binary choice
+    if best_eqn is None:
+        return None
+    values = solver._values
+    for lit in solver._eqn_members[solver._eqn_start[best_eqn]:solver._eqn_start[best_eqn + 1]]:
+        if values[lit >> 1] == UNKNOWN:
+            return lit >> 1, 1 ^ (lit & 1)
+    return None
+
+
+# Value of a proposition we know nothing about yet
+UNKNOWN = -1
+# The stages propagation is made of, and what LogicSolver.enable_metrics counts for each (besides time)
+PROPAGATION_STAGES = ('apply', 'pair_reduce', 'triplet_reduce', 'vectorized')
+STAGE_COUNTERS = ('calls', 'facts_applied', 'eqns_touched', 'inferences', 'eqns_added', 'contradictions')
+# Reason recorded for facts that weren't forced by any equation
+NO_EQN = -1
+
+
+"""
+Not: the negation of a proposition, for use as an equation member or a knowledge key. Not(p) is True exactly when p
+is False, so a solver needs no separate proposition (and no equation tying the two together) for it.
+"""
+
+
+class Not:
+    __slots__ = ('prop',)
+
+    def __init__(self, prop):
+        self.prop = prop
+
+    def __eq__(self, other):
+        return isinstance(other, Not) and self.prop == other.prop
+
+    def __hash__(self):
+        return ~hash(self.prop)
+
+    def __str__(self):
+        return '~{}'.format(self.prop)
+
+    def __repr__(self):
+        return str(self)
+
+
+"""
+ModelTemplate: a LogicSolver's state compiled by LogicSolver.compile(), to be stamped out again with
+LogicSolver.from_template(). It holds the interned propositions and, as read-only memoryviews, the equation store, the
+occurrence index in flat form and the facts known when it was compiled. Nothing in it is changed after it's made, so
+one template can serve any number of solvers.
+
+save() writes a template to a flat binary file, and load() maps one back in: the views then point straight into the
+mapped file, so loading costs next to nothing beyond reading the propositions, and processes loading the same file
+share its pages. The file is in native byte order, for loading on the machine that saved it.
+"""
+
+
+class ModelTemplate:
+    # The memoryview fields with their item types, in the order they're laid out in a saved file: ints first, so that
+    # all of them stay aligned
+    FIELDS = (('eqn_members', 'i'), ('eqn_start', 'i'), ('eqn_unknown', 'i'), ('eqn_lo', 'i'), ('eqn_hi', 'i'),
+              ('lit_start', 'i'), ('lit_eqns', 'i'), ('trail_pos', 'i'), ('reasons', 'i'), ('trail', 'i'),
+              ('values', 'b'), ('eqn_derived', 'B'))
+    __slots__ = ('symbols', 'qhead', 'derived_keys', 'fingerprint') + tuple(name for name, _ in FIELDS)
+
+    # Saved file header: magic, int size, qhead, the length in bytes of each field, then of the pickled
+    # propositions, derived keys and fingerprint
+    MAGIC = b'LSMODEL2'
+    HEADER = struct.Struct('=8s{}q'.format(len(FIELDS) + 3))
+
+    def __init__(self, symbols, views, qhead, derived_keys, fingerprint=None):
+        # fingerprint is whatever compile() was given to say what the model was built for (None if anything)
+        self.symbols = symbols
+        for name, _ in self.FIELDS:
+            setattr(self, name, views[name])
+        self.qhead = qhead
+        self.derived_keys = derived_keys
+        self.fingerprint = fingerprint
+
+    def save(self, path):
+        # Writes the header, the fields back to back, then the propositions, derived keys and fingerprint pickled
+        # (propositions can be any hashable objects, so they're the one part that can't be laid out flat)
+        views = [getattr(self, name) for name, _ in self.FIELDS]
+        extra = pickle.dumps(([self.symbols.lookup(i) for i in range(len(self.symbols))],
+                              [sorted(key) for key in self.derived_keys], self.fingerprint), pickle.HIGHEST_PROTOCOL)
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, array('i').itemsize, self.qhead, *(view.nbytes for view in views),
+                                     len(extra)))
+            for view in views:
+                f.write(view)
+            f.write(extra)
+
+    @classmethod
+    def load(cls, path):
+        # Maps a file written by save() into memory read-only and returns the template over it
+        with open(path, 'rb') as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(data) < cls.HEADER.size or data[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError('{} is not a saved model'.format(path))
+        _, itemsize, qhead, *lengths = cls.HEADER.unpack_from(data)
+        if itemsize != array('i').itemsize:
+            raise ValueError('{} was saved with {}-byte ints, not {}'.format(path, itemsize, array('i').itemsize))
+
+        views = {}
+        offset = cls.HEADER.size
+        for (name, typecode), length in zip(cls.FIELDS, lengths):
+            views[name] = data[offset:offset + length].cast(typecode)
+            offset += length
+        props, derived_keys, fingerprint = pickle.loads(data[offset:offset + lengths[-1]])
+
+        symbols = SymbolTable()
+        for prop in props:
+            symbols.intern(prop)
+        return cls(symbols, views, qhead, frozenset(frozenset(key) for key in derived_keys), fingerprint)
+
+
+def int_array(ints):
+    # An array('i') holding a copy of ints, which is anything supporting the buffer protocol (a memoryview, an
+    # array, ...): copied as one block rather than int by int
+    copy = array('i')
+    copy.frombytes(memoryview(ints).cast('B'))
+    return copy
+
+
+"""
+Conflict: describes a contradiction found while propagating. reason is 'empty range' when an equation was left with
+no allowed number of true propositions, or 'clash' when prop was found to be both True and False. eqns lists the
+equations involved, each as the list of its member propositions (a clash on a given fact may involve just one, or
+none). eqn_ids holds the solver's own indices for the same equations, where there are any.
+"""
+
+
+class Conflict:
+    def __init__(self, reason, eqns, prop=None, eqn_ids=None):
+        self.reason = reason
+        self.eqns = eqns
+        self.prop = prop
+        self.eqn_ids = eqn_ids
+
+    def __str__(self):
+        prop_string = ' on {}'.format(self.prop) if self.prop is not None else ''
+        return 'Conflict({}{}: {})'.format(self.reason, prop_string, self.eqns)
+
+    def __repr__(self):
+        return str(self)
+
+
+def eqn_type_bounds(eqn_type, prop_count, count=None):
+    # The [lo, hi] range of true-counts that an equation of the given type over prop_count propositions allows.
+    # The atleast/atmost/exactly types take their k from count.
+    eqn_type = eqn_type.lower()
+    if eqn_type in ('atleast', 'atmost', 'exactly') and count is None:
+        raise ValueError('Equation type {} needs a count'.format(eqn_type))
+    if eqn_type == 'xor':
+        return 1, 1
+    elif eqn_type == 'nor':
+        return 0, 0
+    elif eqn_type == 'and':
+        return prop_count, prop_count
+    elif eqn_type == 'or':
+        return 1, prop_count
+    elif eqn_type == 'nand':
+        return 0, prop_count - 1
+    elif eqn_type == 'atleast':
+        return count, prop_count
+    elif eqn_type == 'atmost':
+        return 0, count
+    elif eqn_type == 'exactly':
+        return count, count
+    else:
+        raise ValueError('Invalid equation type {}'.format(eqn_type))
+
+
+"""
+SymbolTable: interns arbitrary hashable propositions to dense int IDs (0, 1, 2, ...) and maps them back. The solver
+only ever hashes a proposition object once, when it's first interned.
+"""
+
+
+class SymbolTable:
+    def __init__(self):
+        self._ids = {}
+        self._props = []
+
+    def __len__(self):
+        return len(self._props)
+
+    def intern(self, prop):
+        # Returns the ID for prop, assigning the next free one if it's new
+        prop_id = self._ids.get(prop)
+        if prop_id is None:
+            prop_id = len(self._props)
+            self._ids[prop] = prop_id
+            self._props.append(prop)
+        return prop_id
+
+    def copy(self):
+        # A table with the same IDs, which can go on interning without affecting this one. Copying the dict reuses
+        # the hashes it holds rather than hashing the propositions again.
+        table = SymbolTable()
+        table._ids = self._ids.copy()
+        table._props = self._props[:]
+        return table
+
+    def get_id(self, prop):
+        # Returns the ID for prop, or None if it was never interned
+        return self._ids.get(prop)
+
+    def lookup(self, prop_id):
+        return self._props[prop_id]
+
 
 def gather_all_inferences(prop_eqns):
+    # Returns (inferences, conflict): everything the equations let us infer, and a Conflict if one of them is
+    # contradictory or two of them disagree about a proposition (in which case we stop right there)
     inferences = {}
+    sources = {}
     for s in prop_eqns:
+        if s.is_contradiction():
+            return inferences, Conflict('empty range', [s])
         this_set_knowledge = s.get_inferences()
-        # TODO: this would be a good time to check whether any pair of things added here contradict each other
-        inferences.update(this_set_knowledge)
-    return inferences
+        for prop, value in this_set_knowledge.items():
+            if prop in inferences and inferences[prop] != value:
+                return inferences, Conflict('clash', [sources[prop], s], prop)
+            inferences[prop] = value
+            sources[prop] = s
+    return inferences, None
 
 
 """
@@ -89,28 +968,26 @@ can be inserted into a set() and the set may have one of the following initial t
 - AND (# true propoositions in [n,n])
 - OR (# true propoositions in [1,n])
 - NAND (# true propoositions in [0,n-1])
+- ATLEAST k (# true propositions in [k,n])
+- ATMOST k (# true propositions in [0,k])
+- EXACTLY k (# true propositions in [k,k])
 
 """
 
 
 class PropositionEqn:
-    def __init__(self, input_list, settype='xor'):
+    def __init__(self, input_list, settype='xor', count=None):
         self._set = set(input_list)
 
-        prop_count = len(self._set)
+        # Allowed numbers of true propositions are always a contiguous range, so we only keep its ends
+        self._lo, self._hi = eqn_type_bounds(settype, len(self._set), count)
 
-        if settype.lower() == 'xor':
-            self._truecount = list(range(1, 1+1))
-        elif settype.lower() == 'nor':
-            self._truecount = list(range(0, 0+1))
-        elif settype.lower() == 'and':
-            self._truecount = list(range(prop_count, prop_count + 1))
-        elif settype.lower() == 'or':
-            self._truecount = list(range(1, prop_count + 1))
-        elif settype.lower() == 'nand':
-            self._truecount = list(range(0, (prop_count - 1) + 1))
-        else:
-            print("Invalid PropositionEqn type", settype, "! This will probably fail soon.")
+    @classmethod
+    def from_bounds(cls, input_list, lo, hi):
+        # An equation allowing from lo to hi of the propositions in input_list to be true, whatever type that is
+        eqn = cls(input_list, 'nand')
+        eqn._lo, eqn._hi = lo, hi
+        return eqn
 
     def __str__(self):
         if self.is_and():
@@ -127,7 +1004,7 @@ class PropositionEqn:
             dominant_type = None
 
         numtrue_string = dominant_type if dominant_type \
-            else 'numtrue={}'.format(','.join(str(item) for item in self._truecount))
+            else 'numtrue={}..{}'.format(self._lo, self._hi)
 
         return 'PropositionEqn(count={},{}: {})'\
             .format(len(self._set), numtrue_string, str(self._set))
@@ -138,30 +1015,29 @@ class PropositionEqn:
     # Functions to determine what basic types apply to this eqn. (Multiple might apply)
 
     def is_xor(self):
-        return len(self._truecount) == 1 and self._truecount[0] == 1
+        return self._lo == self._hi == 1
 
     def is_nor(self):
-        return len(self._truecount) == 1 and self._truecount[0] == 0
+        return self._lo == self._hi == 0
 
     def is_and(self):
-        prop_count = len(self._set)
-        return len(self._truecount) == 1 and self._truecount[0] == prop_count
+        return self._lo == self._hi == len(self._set)
 
     def is_or(self):
         prop_count = len(self._set)
-        our_counts = set(self._truecount)
-        true_or_counts = set(range(1, prop_count+1))
-        return our_counts == true_or_counts
+        return prop_count >= 1 and self._lo == 1 and self._hi == prop_count
 
     def is_nand(self):
         prop_count = len(self._set)
-        our_counts = set(self._truecount)
-        true_nand_counts = set(range(0, (prop_count-1)+1))
-        return our_counts == true_nand_counts
+        return prop_count >= 1 and self._lo == 0 and self._hi == prop_count - 1
+
+    def is_contradiction(self):
+        # No number of true propositions is allowed: the equation can't be satisfied
+        return self._lo > self._hi
 
     """ 
         apply_information: transforms this equation's contents to conform to the new information that a
-        certain proposition has a given truth value
+        certain proposition has a given truth value. Returns False if that leaves the equation contradictory.
     """
     def apply_information(self, proposition, truth_value):
         if proposition in self._set:
@@ -170,19 +1046,20 @@ class PropositionEqn:
 
             # Update possible numbers of true propositions left
             if truth_value:  # proposition was true
-                # Subtract one from everything
-                self._truecount = [i-1 for i in self._truecount]
+                # Subtract one from both ends
+                self._lo -= 1
+                self._hi -= 1
             # If the proposition was false, counts remain the same
 
             # Restrict to range [0, n], the only values that make sense
-            prop_count = len(self._set)
-            self._truecount = list(filter(lambda c: 0 <= c <= prop_count, self._truecount))
+            self._lo = max(self._lo, 0)
+            self._hi = min(self._hi, len(self._set))
 
             # Check validity of possible numbers of true propositions left
 
-            if len(self._truecount) == 0:
-                print('apply_information: contradiction reached!')
-                # TODO: account for this gracefully
+            if self._lo > self._hi:
+                return False
+        return True
 
     """
         get_inferences: acquire a dictionary of the form {prop: truth_value, prop2: truth_value2 ... } describing any
@@ -227,17 +1104,11 @@ def main():
     s.add_equation(['p0', 'q1'], 'or')
     s.add_true_propositions(['p1'])
 
-    for i in range(7):
-        print()
-        print(i)
-        print(s._knowledge)
-        print(s._prop_eqns)
-
-        s.run_iter()
-
-        if s.is_done():
-            print('Done!')
-            break
+    s.propagate()
+    print(s.get_knowledge())
+    print(s.get_equations())
+    if s.is_done():
+        print('Done!')
 
 
 if __name__ == "__main__":
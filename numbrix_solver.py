@@ -1,176 +1,436 @@
 # numbrix_solver.py: a Numbrix solver using logic_solver
 
-from logic_solver import LogicSolver
-from pprint import pprint
-import itertools
+import argparse
+import hashlib
+import sys
+from collections import deque
+from logic_solver import LogicSolver, ModelTemplate, Not
+from tracing import ConsoleReporter, SamplingProfiler
 
 
 class NumbrixSolver:
 
-    # TODO this whole thing
-    def __init__(self, board, verbose=False):
-        # Setup
+    def __init__(self, board, verbose=False, solver_class=LogicSolver, template=None, reporter=None):
+        # Setup. solver_class picks the engine: LogicSolver, or one with the same interface such as
+        # bitset_solver.BitsetSolver or cdcl_solver.CDCLSolver. template is this board's model from numbrix_template
+        # (perhaps saved and loaded back), to stamp the solver out of rather than build the model again; only
+        # engines with from_template can use it. A template made for another board raises ValueError.
+        # reporter(event, data) hears how it goes (see tracing.ConsoleReporter); nothing is reported without one.
+        # verbose reports to the console if no reporter is given, and adds the engine's stage events to it.
+        if reporter is None and verbose:
+            reporter = ConsoleReporter()
         self._board = board
         self._verbose = verbose
-        self._logicsolver = LogicSolver(verbose)
-
-        board_to_prop_sets(self._logicsolver, board, verbose)
+        self._reporter = reporter
+        if template is not None:
+            check_template(template, board)
+            self._logicsolver = solver_class.from_template(template, verbose)
+            add_clues(self._logicsolver, board, reporter)
+        else:
+            self._logicsolver = solver_class(verbose)
+            board_to_prop_sets(self._logicsolver, board, reporter)
+        if verbose and reporter is not None and hasattr(self._logicsolver, 'set_tracer'):
+            self._logicsolver.set_tracer(reporter)
         # Solve now
         self._solve()
 
     def _solve(self):
-
-        print("Initial Board:")
-        print_board(self._board)
-        print()
-
-        # The main loop
-
-        pos_knowledge_count, neg_knowledge_count = 0, 0
-
-        for iternum in itertools.count(0):
-
+        reporter = self._reporter
+        if reporter is not None:
+            reporter('board', {'label': 'Initial Board', 'board': self._board})
+            reporter('sets', {'count': self._logicsolver.get_num_sets()})
+
+        # Propagate everything that follows from what we know in one go, then search for the rest
+        self._solved = self._propagate() and self._logicsolver.solve()
+        if self._solved:
+            pos_knowledge, _ = self._logicsolver.get_knowledge()
+            knowledge_to_board(pos_knowledge, self._board)
+
+        if reporter is not None:
+            reporter('result', {'solved': self._solved})
+            if self._solved:
+                reporter('board', {'board': self._board})
             pos_knowledge, neg_knowledge = self._logicsolver.get_knowledge()
-            pos_knowledge_incr = len(pos_knowledge) - pos_knowledge_count
-            neg_knowledge_incr = len(neg_knowledge) - neg_knowledge_count
-
-            pos_knowledge_count, neg_knowledge_count = len(pos_knowledge), len(neg_knowledge)
-
-            num_sets = self._logicsolver.get_num_sets()
-
-            print('Starting Iteration #{}'.format(iternum + 1))
-            print("Sets: {}".format(num_sets))
-            print("Accounting for new knowledge: {} positive facts, {} negative.".format(pos_knowledge_incr,
-                                                                                         neg_knowledge_incr))
-
-            self._logicsolver.run_iter()
-
-            print("Updated Board:")
-            print_board(board)
-
-            print()
+            reporter('summary', {'sets': self._logicsolver.get_num_sets(), 'positive': len(pos_knowledge),
+                                 'negative': len(neg_knowledge)})
+            reporter('finished', {})
 
-            # Should we continue?
-            if self._logicsolver.is_done():
-                print("Puzzle complete!")
-                break
+    def is_solved(self):
+        return self._solved
 
-        pos_knowledge, neg_knowledge = self._logicsolver.get_knowledge()
+    def get_board(self):
+        return self._board
 
-        pos_knowledge_incr = len(pos_knowledge) - pos_knowledge_count
-        neg_knowledge_incr = len(neg_knowledge) - neg_knowledge_count
-
-        num_sets = self._logicsolver.get_num_sets()
-
-        print("Final Sets: {}".format(num_sets))
-        print("Knowledge from last iteration: {} positive facts, {} negative.".format(pos_knowledge_incr,
-                                                                                      neg_knowledge_incr))
-        print('Finished')
-
-
-def board_to_prop_sets(logicsolver, board, verbose=False):
-    # Build listing of prop sets
-    num_rows = len(board)
-    num_cols = len(board[0])
+    def _propagate(self):
+        # Alternates the solver's own propagation with structural_eliminations over what it leaves open, feeding the
+        # eliminated candidates back as False facts, until neither finds anything new. Returns False on a conflict.
+        domains = candidate_domains(self._board)
+        while self._logicsolver.propagate() is None:
+            pos_knowledge, neg_knowledge = self._logicsolver.get_knowledge()
+            for prop in neg_knowledge:
+                domains[prop.row][prop.col].discard(prop.value)
+            for prop in pos_knowledge:
+                domains[prop.row][prop.col] &= {prop.value}
+
+            eliminated = structural_eliminations(domains)
+            if self._verbose and self._reporter is not None:
+                self._reporter('structural_eliminations', {'count': len(eliminated)})
+            if not eliminated:
+                return True
+            self._logicsolver.add_false_propositions([NumbrixProposition(r, c, v) for r, c, v in eliminated])
+        return False
+
+
+def board_to_prop_sets(logicsolver, board, reporter=None):
+    # Build listing of prop sets, clues included, telling reporter (if any) how many candidates there are
+    domains = candidate_domains(board)
+    add_numbrix_equations(logicsolver, domains)
+    add_clues(logicsolver, board, reporter)
+    if reporter is not None:
+        num_values = len(board) * len(board[0])
+        reporter('candidates', {'count': sum(len(d) for row in domains for d in row), 'total': num_values * num_values})
+
+
+def numbrix_template(board):
+    # The compiled LogicSolver model of board, clues left out. The clues still decide which propositions and
+    # equations it has (see candidate_domains), so it's only good for this board: save it with ModelTemplate.save
+    # to skip building the model when solving the same board again, or in many processes.
+    logicsolver = LogicSolver()
+    add_numbrix_equations(logicsolver, candidate_domains(board))
+    return logicsolver.compile(board_fingerprint(board))
+
+
+def board_fingerprint(board):
+    # A digest of board's size and clues, which is everything its model depends on
+    clues = [(r, c, value) for r, row in enumerate(board) for c, value in enumerate(row) if value]
+    return hashlib.sha256(repr((len(board), len(board[0]), clues)).encode()).digest()
+
+
+def check_template(template, board):
+    # Raises ValueError unless template is the model of board (see numbrix_template). Without a fingerprint to go
+    # on, every clue at least needs a proposition in it; otherwise it would be taken on trust rather than checked.
+    if template.fingerprint is not None:
+        if template.fingerprint != board_fingerprint(board):
+            raise ValueError('The model was compiled for a different board')
+    elif any(template.symbols.get_id(prop) is None for prop in clue_propositions(board)):
+        raise ValueError('The board has clues the model has no place for')
+
+
+def add_numbrix_equations(logicsolver, domains):
+    # Only the (cell, value) pairs in domains get a proposition at all, and each implication lists just the
+    # neighbours still able to hold the value it needs
+    num_rows = len(domains)
+    num_cols = len(domains[0])
     num_values = num_rows * num_cols
 
     # We'll think internally of the row and col numbers being 0, 1, ... n
     # and the values being 0, 1, ... (n^2)-1, but increase by one before showing the user
 
+    # Every proposition (and its negation) is built once and shared by all the equations it appears in
+    cell_props = [[{v: NumbrixProposition(r, c, v) for v in sorted(domains[r][c])} for c in range(num_cols)]
+                  for r in range(num_rows)]
+
     # Build up list of sets relating propositions
 
     # Sets to require that each cell have only one value
     for r in range(num_rows):
         for c in range(num_cols):
-            props = []
-            for v in range(num_values):
-                props.append(NumbrixProposition(r, c, v, True))
-            logicsolver.add_equation(props, 'xor')
-
-    # Sets to require that either a cell is something, or it is not
-    for r in range(num_rows):
-        for c in range(num_cols):
-            for v in range(num_values):
-                props = [NumbrixProposition(r, c, v, True), NumbrixProposition(r, c, v, False)]
-                logicsolver.add_equation(props, 'xor')
+            logicsolver.add_equation(list(cell_props[r][c].values()), 'xor')
 
     # Sets to require that each value be in only one cell
     for v in range(num_values):
         props = []
         for r in range(num_rows):
             for c in range(num_cols):
-                props.append(NumbrixProposition(r, c, v, True))
+                if v in cell_props[r][c]:
+                    props.append(cell_props[r][c][v])
         logicsolver.add_equation(props, 'xor')
 
     # Sets to require that a cell having a given value requires that its neighbors have the preceding and succeeding values
-    for v in range(num_values):
-        for r in range(num_rows):
-            for c in range(num_cols):
+    for r in range(num_rows):
+        for c in range(num_cols):
+            neighbours = grid_neighbours(r, c, num_rows, num_cols)
+            for v, prop in cell_props[r][c].items():
+                not_prop = Not(prop)
                 for v_neigh in [v-1, v+1]:
                     if v_neigh < 0 or v_neigh >= num_values:
                         continue  # OOB on value
                     # For this combo v,r,c, one of the neighbors has got to have the value v_neigh
                     # Simulates P -> Q using the synonym ~P V Q.
-
-                    props = [NumbrixProposition(r, c, v, False)]
-                    for r_neigh in [r-1, r+1]:
-                        if r_neigh < 0 or r_neigh >= num_rows:
-                            continue  # OOB on row
-                        props.append(NumbrixProposition(r_neigh, c, v_neigh, True))
-                    for c_neigh in [c-1, c+1]:
-                        if c_neigh < 0 or c_neigh >= num_cols:
-                            continue  # OOB on col
-                        props.append(NumbrixProposition(r, c_neigh, v_neigh, True))
+                    props = [not_prop]
+                    for r_neigh, c_neigh in neighbours:
+                        if v_neigh in cell_props[r_neigh][c_neigh]:
+                            props.append(cell_props[r_neigh][c_neigh][v_neigh])
                     logicsolver.add_equation(props, 'or')
 
+
+def add_clues(logicsolver, board, reporter=None):
     # Take apart board's inital state and break into true propositions
-    # TODO
+    clues = clue_propositions(board)
+    logicsolver.add_true_propositions(clues)
+
+    if reporter is not None:
+        reporter('initialized', {'sets': logicsolver.get_num_sets(), 'clues': len(clues)})
+
 
-    print("Initialized with {} sets.".format(logicsolver.get_num_sets()))
-    # if verbose:
-    #     print("Initial Sets:")
-    #     pprint(prop_sets)
+def clue_propositions(board):
+    return [NumbrixProposition(r, c, value - 1) for r, row in enumerate(board) for c, value in enumerate(row) if value]
 
 
-# NumbrixProposition: a proposition-holder for Numbrix solving. Comparable objects not meant to be edited after construction.
+def candidate_domains(board):
+    # The values (0-indexed) each cell could hold, given the clues: a clue's cell holds just that value, and since
+    # consecutive values are adjacent, value v can't be farther than |v - g| steps from the cell holding clue g.
+    # Then a value is dropped from a cell while no neighbour can hold the value before it, or none the value after
+    # it; each removal rechecks only the neighbouring pairs it could have been supporting.
+    num_rows = len(board)
+    num_cols = len(board[0])
+    num_values = num_rows * num_cols
+
+    clues = [(r, c, board[r][c] - 1) for r in range(num_rows) for c in range(num_cols) if board[r][c]]
+    for r, c, g in clues:
+        if g >= num_values:
+            raise ValueError('Clue {} at ({}, {}) is out of range for a {}x{} board'.format(g + 1, r, c, num_rows,
+                                                                                            num_cols))
+
+    domains = []
+    for r in range(num_rows):
+        row = []
+        for c in range(num_cols):
+            if board[r][c]:
+                row.append({board[r][c] - 1})
+                continue
+            allowed = bytearray(b'\x01') * num_values
+            for r_clue, c_clue, g in clues:
+                reach = abs(r - r_clue) + abs(c - c_clue)
+                lo, hi = max(g - reach + 1, 0), min(g + reach, num_values)
+                if lo < hi:
+                    allowed[lo:hi] = bytes(hi - lo)
+            row.append({v for v in range(num_values) if allowed[v]})
+        domains.append(row)
+
+    def is_supported(r, c, v):
+        for v_neigh in [v-1, v+1]:
+            if 0 <= v_neigh < num_values and not any(v_neigh in domains[r_neigh][c_neigh]
+                                                     for r_neigh, c_neigh in grid_neighbours(r, c, num_rows, num_cols)):
+                return False
+        return True
+
+    worklist = [(r, c, v) for r in range(num_rows) for c in range(num_cols) for v in domains[r][c]]
+    while worklist:
+        r, c, v = worklist.pop()
+        if v not in domains[r][c] or is_supported(r, c, v):
+            continue
+        domains[r][c].discard(v)
+        for r_neigh, c_neigh in grid_neighbours(r, c, num_rows, num_cols):
+            for v_neigh in [v-1, v+1]:
+                if v_neigh in domains[r_neigh][c_neigh]:
+                    worklist.append((r_neigh, c_neigh, v_neigh))
+    return domains
+
+
+def structural_eliminations(domains):
+    # Candidates (row, col, value) that the shape of a Numbrix path rules out, given the values each cell could still
+    # hold. Cells with a single candidate count as placed. Three checks:
+    # - Parity: consecutive values sit on adjacent cells, which alternate colours on a checkerboard, so
+    #   (row + col + value) has the same parity for every placement on the path.
+    # - Distance: between consecutive placed values a and b, value v must be within v - a steps of a's cell and
+    #   b - v steps of b's, walking only through cells that could hold something strictly between a and b (likewise
+    #   before the first placed value and after the last).
+    # - Connectivity: those in-between values form one run through the unplaced cells, so they lie in a single
+    #   region of them, touching both a's and b's cells. A region must be exactly filled by the runs that can go
+    #   there; when it can't, every candidate of one of its cells is eliminated, which the solver finds contradictory.
+    num_rows = len(domains)
+    num_cols = len(domains[0])
+    num_values = num_rows * num_cols
+    cells = [(r, c) for r in range(num_rows) for c in range(num_cols)]
+    placed = {}
+    for r, c in cells:
+        if len(domains[r][c]) == 1:
+            placed[next(iter(domains[r][c]))] = (r, c)
+    if not placed:
+        return []
+    eliminated = set()
+
+    # Parity
+    v_placed, (r_placed, c_placed) = next(iter(placed.items()))
+    parity = (r_placed + c_placed + v_placed) % 2
+    for r, c in cells:
+        for v in domains[r][c]:
+            if (r + c + v) % 2 != parity:
+                eliminated.add((r, c, v))
+
+    # The regions of unplaced cells, as a region number per cell
+    region_of = {}
+    region_sizes = []
+    for cell in cells:
+        if cell in region_of or len(domains[cell[0]][cell[1]]) == 1:
+            continue
+        region_of[cell] = len(region_sizes)
+        queue = deque([cell])
+        size = 0
+        while queue:
+            r, c = queue.popleft()
+            size += 1
+            for neigh in grid_neighbours(r, c, num_rows, num_cols):
+                if neigh not in region_of and len(domains[neigh[0]][neigh[1]]) != 1:
+                    region_of[neigh] = len(region_sizes)
+                    queue.append(neigh)
+        region_sizes.append(size)
+
+    # Each stretch of unplaced values: between consecutive placed ones, before the first and after the last. An
+    # end with no placed value is -1 or num_values.
+    placed_values = sorted(placed)
+    stretches = list(zip([-1] + placed_values, placed_values + [num_values]))
+    region_forced = [0] * len(region_sizes)
+    region_possible = [0] * len(region_sizes)
+    for a, b in stretches:
+        if b - a <= 1:
+            continue
+
+        def passable(cell):
+            return any(a < v < b for v in domains[cell[0]][cell[1]])
+
+        steps = [bfs_steps(placed[end], passable, num_rows, num_cols) for end in (a, b) if end in placed]
+        for r, c in cells:
+            for v in domains[r][c]:
+                if a < v < b and ((a in placed and steps[0].get((r, c), num_values) > v - a) or
+                                  (b in placed and steps[-1].get((r, c), num_values) > b - v)):
+                    eliminated.add((r, c, v))
+
+        # The regions touching every placed end of this stretch
+        touching = None
+        for end in (a, b):
+            if end in placed:
+                regions = {region_of[neigh] for neigh in grid_neighbours(*placed[end], num_rows, num_cols)
+                           if neigh in region_of}
+                touching = regions if touching is None else touching & regions
+        for r, c in cells:
+            if region_of.get((r, c)) not in touching:
+                eliminated.update((r, c, v) for v in domains[r][c] if a < v < b)
+        for region in touching:
+            region_possible[region] += b - a - 1
+        if len(touching) == 1:
+            region_forced[next(iter(touching))] += b - a - 1
+
+    for region, size in enumerate(region_sizes):
+        if region_forced[region] > size or region_possible[region] < size:
+            r, c = next(cell for cell in cells if region_of.get(cell) == region)
+            eliminated.update((r, c, v) for v in domains[r][c])
+
+    return sorted(eliminated)
+
+
+def bfs_steps(start, passable, num_rows, num_cols):
+    # Fewest steps from start to each cell reachable through passable cells, as a dict by cell
+    steps = {start: 0}
+    queue = deque([start])
+    while queue:
+        r, c = queue.popleft()
+        for neigh in grid_neighbours(r, c, num_rows, num_cols):
+            if neigh not in steps and passable(neigh):
+                steps[neigh] = steps[(r, c)] + 1
+                queue.append(neigh)
+    return steps
+
+
+def grid_neighbours(r, c, num_rows, num_cols):
+    # The orthogonally adjacent cells of (r, c) that are on the board
+    return [(r_neigh, c_neigh) for r_neigh, c_neigh in [(r-1, c), (r+1, c), (r, c-1), (r, c+1)]
+            if 0 <= r_neigh < num_rows and 0 <= c_neigh < num_cols]
+
+
+def parse_board(lines):
+    # Reads a board in the numbrix/puzzles format: one line per row, each cell a fixed-width field holding its value,
+    # or dashes if it's empty. The board is square, so the field width is the line length over the number of rows.
+    # Returns rows of ints, 0 for an empty cell.
+    rows = [line.strip() for line in lines if line.strip()]
+    width = len(rows[0]) // len(rows)
+    board = []
+    for row in rows:
+        if width == 0 or len(row) != width * len(rows):
+            raise ValueError('Expected {} cells of width {} in row {!r}'.format(len(rows), width, row))
+        fields = [row[i:i + width] for i in range(0, len(row), width)]
+        board.append([0 if field.strip('-') == '' else int(field) for field in fields])
+    return board
+
+
+def knowledge_to_board(pos_knowledge, board):
+    # Fills in the board from the True propositions we've found, showing values 1-indexed
+    for prop in pos_knowledge:
+        board[prop.row][prop.col] = prop.value + 1
+
+
+# NumbrixProposition: the proposition "cell (row, col) holds value", for Numbrix solving. Its negation is
+# Not(NumbrixProposition(...)). Immutable and slotted, with the hash computed once, since the solvers hash every
+# proposition when interning it.
 
 
 class NumbrixProposition:
-    def __init__(self, row, col, value, truthval):
-        self.row = row
-        self.col = col
-        self.value = value
-        self.truthval = truthval
+    __slots__ = ('row', 'col', 'value', '_hash')
+
+    def __init__(self, row, col, value):
+        object.__setattr__(self, 'row', row)
+        object.__setattr__(self, 'col', col)
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, '_hash', hash((row, col, value)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('NumbrixProposition is immutable')
 
     def __eq__(self, other):
-        if self.row != other.row:
-            return False
-        if self.col != other.col:
-            return False
-        if self.value != other.value:
-            return False
-        if self.truthval != other.truthval:
-            return False
-        return True
+        return isinstance(other, NumbrixProposition) and self.row == other.row and self.col == other.col \
+            and self.value == other.value
 
     def __hash__(self):
-        return hash((self.row, self.col, self.value, self.truthval))
+        return self._hash
+
+    def __reduce__(self):
+        # Pickle as a call to the constructor, which sets the slots that __setattr__ won't
+        return NumbrixProposition, (self.row, self.col, self.value)
 
     def __str__(self):
-        return "{}_{}_{}_{}".format(self.row, self.col, self.value, self.truthval)
+        return "{}_{}_{}".format(self.row, self.col, self.value)
 
     def __repr__(self):
         return str(self)
 
 
-def main():
-    # For testing
-    s = LogicSolver()
-    board = [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
-    board_to_prop_sets(s, board)
-    pprint(s._prop_eqns)
-    pass
+def main(argv):
+    # Solves a board from a file (see parse_board for the format), or for testing an empty 4x4 board
+    parser = argparse.ArgumentParser(prog=argv[0], description='Solve a Numbrix puzzle')
+    parser.add_argument('board', nargs='?', help='file holding the board (default: an empty 4x4 board)')
+    model = parser.add_mutually_exclusive_group()
+    model.add_argument('--save-model', metavar='PATH', help='write the board\'s compiled model here before solving')
+    model.add_argument('--model', metavar='PATH',
+                       help='solve with the model saved here for the same board instead of building it')
+    parser.add_argument('--verbose', action='store_true', help='report each propagation stage as well')
+    parser.add_argument('--profile', action='store_true', help='sample where the time goes and report it at the end')
+    args = parser.parse_args(argv[1:])
+
+    if args.board:
+        with open(args.board) as f:
+            board = parse_board(f)
+    else:
+        board = [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
+
+    template = None
+    if args.model:
+        template = ModelTemplate.load(args.model)
+        try:
+            check_template(template, board)
+        except ValueError as e:
+            print('Error: {} ({})'.format(e, args.model))
+            return
+    elif args.save_model:
+        template = numbrix_template(board)
+        template.save(args.save_model)
+    if args.profile:
+        with SamplingProfiler() as profiler:
+            NumbrixSolver(board, args.verbose, template=template, reporter=ConsoleReporter())
+        profiler.report()
+    else:
+        NumbrixSolver(board, args.verbose, template=template, reporter=ConsoleReporter())
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv)
@@ -0,0 +1,198 @@
+# puzzle_io.py: streams puzzles in from files of any size a line at a time, and results out a block at a time
+
+import csv
+import glob
+import io
+import json
+import math
+import os
+from itertools import chain
+from numbrix_solver import parse_board
+
+# The value of each byte as a Sudoku cell: the digits 1-9 are clues, anything else ('.', '0', '-', ...) is empty.
+# bytes.translate decodes a whole row or puzzle line with it at once.
+SUDOKU_CELLS = bytes(byte - ord('0') if ord('1') <= byte <= ord('9') else 0 for byte in range(256))
+
+PUZZLE_FORMATS = ('line', 'grid', 'numbrix')
+
+# Bytes read from a puzzle file at a time
+READ_BUFFER_SIZE = 1 << 20
+
+
+def iter_puzzles(source, puzzle_format=None, keep_invalid=False):
+    # Yields (puzzle ID, board) for every puzzle in source: a directory (each .txt file in it), a glob pattern
+    # matching puzzle files, or a single file. Files are read a line at a time, so only the puzzle being parsed is
+    # held in memory however big they are. See read_puzzles for the formats, and keep_invalid.
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, '*.txt')))
+    elif glob.has_magic(source):
+        paths = sorted(glob.glob(source))
+    else:
+        paths = [source]
+
+    for path in paths:
+        with open(path, 'rb', buffering=READ_BUFFER_SIZE) as f:
+            yield from read_puzzles(f, path, puzzle_format, keep_invalid)
+
+
+def read_puzzles(f, name, puzzle_format=None, keep_invalid=False):
+    # Yields (puzzle ID, board) for each puzzle in binary file f, with boards as rows of ints, 0 for an empty cell.
+    # Blank lines are skipped. puzzle_format is one of:
+    #   'line': one Sudoku per line, its cells in reading order (see parse_puzzle_line). IDs are name:line number.
+    #   'grid': Sudoku boards of n lines of n characters each, one after another. The ID is name for a file holding
+    #       one board, otherwise name:line number of its first row.
+    #   'numbrix': a single board in the numbrix/puzzles format (see numbrix_solver.parse_board). The ID is name.
+    # With no puzzle_format it's told from the start of the file (see detect_format).
+    # A puzzle that can't be parsed raises ValueError, or with keep_invalid is yielded with None for its board, so
+    # one bad puzzle in a collection doesn't stop the rest being read.
+    def parsed(parse, *args):
+        try:
+            return parse(*args)
+        except ValueError:
+            if not keep_invalid:
+                raise
+            return None
+
+    lines = _content_lines(f)
+    first = next(lines, None)
+    if first is None:
+        return
+    if puzzle_format is None:
+        puzzle_format, lines_read = detect_format(first, lines)
+    else:
+        lines_read = [first]
+    lines = chain(lines_read, lines)
+
+    if puzzle_format == 'line':
+        for line_number, line in lines:
+            yield '{}:{}'.format(name, line_number), parsed(parse_puzzle_line, line)
+    elif puzzle_format == 'grid':
+        # Each board is held back until we know whether another follows, which decides its ID
+        previous = None
+        for line_number, line in lines:
+            rows = [line] + [next(lines, (None, b''))[1] for _ in range(len(line) - 1)]
+            if previous is not None:
+                yield '{}:{}'.format(name, previous[0]), previous[1]
+            previous = (line_number, parsed(parse_grid, rows, name, line_number))
+        yield (name if previous[0] == first[0] else '{}:{}'.format(name, previous[0])), previous[1]
+    elif puzzle_format == 'numbrix':
+        yield name, parsed(parse_board, [line.decode() for _, line in lines])
+    else:
+        raise ValueError('Unknown puzzle format {}; choose from {}'.format(puzzle_format, ', '.join(PUZZLE_FORMATS)))
+
+
+def detect_format(first, lines):
+    # Tells the format of a file from its first (line number, line) and as few of the following lines as it takes.
+    # Returns the format and the lines it read, which are still to be parsed.
+    # A first line of digits and dashes, with some dashes, may be the top row of a Numbrix board: it is if the whole
+    # file is lines like it, as many as make a square board of cells at least 2 characters wide, and every line
+    # splits into cells of that width that are each all dashes or a number on the board (see
+    # numbrix_solver.parse_board). A dataset of one-line puzzles with '-' for blanks can have the right number of
+    # lines, but its lines don't split like that. Otherwise a first line of up to 9 characters is the top row of a
+    # grid (a grid has more rows than a Numbrix board that short could), and anything else is one puzzle per line.
+    text = first[1]
+    lines_read = [first]
+    if b'-' in text and not text.strip(b'0123456789-'):
+        for line in lines:
+            lines_read.append(line)
+            if len(lines_read) > len(text) // 2:
+                break
+        else:
+            side_length = len(lines_read)
+            if side_length > 1 and len(text) % side_length == 0 \
+                    and all(_is_numbrix_row(line, side_length) for _, line in lines_read):
+                return 'numbrix', lines_read
+    if len(text) <= 9:
+        return 'grid', lines_read
+    return 'line', lines_read
+
+
+def _is_numbrix_row(line, side_length):
+    # Whether line is side_length cells of the same width, each all dashes or a number from 1 to side_length^2
+    width = len(line) // side_length
+    if len(line) != width * side_length:
+        return False
+    for i in range(0, len(line), width):
+        field = line[i:i + width]
+        if field.strip(b'-') and not (field.isdigit() and 0 < int(field) <= side_length * side_length):
+            return False
+    return True
+
+
+def parse_puzzle_line(line):
+    # A Sudoku board from its cells in reading order (str or bytes), e.g. the 81 characters of a 9x9 puzzle. Up to
+    # 9x9 each character is a cell (see SUDOKU_CELLS); bigger boards separate their cells with commas.
+    if isinstance(line, str):
+        line = line.encode()
+    if b',' in line:
+        cells = [int(field) if field.strip().isdigit() else 0 for field in line.split(b',')]
+    else:
+        cells = line.translate(SUDOKU_CELLS)
+    side_length = math.isqrt(len(cells))
+    if side_length * side_length != len(cells):
+        raise ValueError('A puzzle line needs a square number of cells, not {}'.format(len(cells)))
+    return [list(cells[r * side_length:(r + 1) * side_length]) for r in range(side_length)]
+
+
+def parse_grid(rows, name, line_number):
+    # A Sudoku board from its rows (bytes, one character per cell, see SUDOKU_CELLS), read from name:line_number
+    if any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError('Expected {} rows of {} cells from {}:{}'.format(len(rows[0]), len(rows[0]), name,
+                                                                            line_number))
+    return [list(row.translate(SUDOKU_CELLS)) for row in rows]
+
+
+def board_to_string(board):
+    # The cells in reading order as parse_puzzle_line reads them: one character each up to 9x9, comma-separated for
+    # bigger boards
+    separator = '' if len(board) <= 9 else ','
+    return separator.join(str(value) for row in board for value in row)
+
+
+def _content_lines(f):
+    # (line number, line) for each non-blank line of binary file f, stripped
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if line:
+            yield line_number, line
+
+
+class ResultWriter:
+
+    def __init__(self, out, fields, output_format='jsonl', buffer_size=1 << 16):
+        # Writes result dicts to text stream out as JSON lines, or as CSV with the given fields. Results are gathered
+        # into blocks of about buffer_size characters, so out gets one write per block rather than one per result.
+        # close() writes out the last block (leaving out open); as a context manager that's done on exit.
+        if output_format not in ('jsonl', 'csv'):
+            raise ValueError('Unknown output format {}'.format(output_format))
+        self._out = out
+        self._buffer_size = buffer_size
+        self._buffer = io.StringIO()
+        self._csv = None
+        if output_format == 'csv':
+            self._csv = csv.DictWriter(self._buffer, fieldnames=fields)
+            self._csv.writeheader()
+
+    def write(self, result):
+        if self._csv is not None:
+            self._csv.writerow(result)
+        else:
+            self._buffer.write(json.dumps(result))
+            self._buffer.write('\n')
+        if self._buffer.tell() >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        # Writes out what's gathered so far
+        self._out.write(self._buffer.getvalue())
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,136 @@
+# batch.py: solves whole collections of Sudoku puzzles across a process pool, streaming one result per puzzle
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from bitmask_solver import sudoku_geometry
+from canonical import SolutionCache
+from puzzle_io import PUZZLE_FORMATS, ResultWriter, board_to_string, iter_puzzles
+from sudoku_solver import sudoku_template
+from solve import ENGINES
+
+RESULT_FIELDS = ['id', 'status', 'time_ms', 'solution']
+
+
+def solve_puzzles(puzzles, engine='bitmask', jobs=None, chunksize=64, cache_size=0):
+    # Yields a result dict (see RESULT_FIELDS) for each (puzzle ID, board) in puzzles, in order. With more than one
+    # job the puzzles go to a pool of worker processes chunksize at a time, so a worker handles a whole chunk per
+    # round trip. Chunks are read from puzzles only as results come back, a couple per worker ahead (Executor.map
+    # would read all of them up front), so memory stays flat however many puzzles there are.
+    # With a cache_size, each worker keeps the solutions of the last cache_size puzzles it solved by canonical form
+    # (see canonical.py), and answers a puzzle equivalent to one of them from that.
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1:
+        _init_worker(engine, cache_size)
+        for puzzle in puzzles:
+            yield _solve_one(puzzle)
+        return
+    puzzles = iter(puzzles)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(engine, cache_size)) as executor:
+        in_flight = deque()
+        while True:
+            while len(in_flight) < 2 * jobs:
+                chunk = list(islice(puzzles, chunksize))
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(_solve_chunk, chunk))
+            if not in_flight:
+                return
+            yield from in_flight.popleft().result()
+
+
+# State of each worker process, set up once by _init_worker
+_worker_engine = None
+_worker_cache = None
+
+
+def _init_worker(engine, cache_size=0):
+    # Picks the engine and builds what it needs for a 9x9 board: the geometry for the bitmask engine, the compiled
+    # model for the logic one (other sizes get built the first time they turn up)
+    global _worker_engine, _worker_cache
+    _worker_engine = ENGINES[engine]
+    _worker_cache = SolutionCache(cache_size) if cache_size else None
+    if engine == 'bitmask':
+        sudoku_geometry(9)
+    elif engine == 'logic':
+        sudoku_template(9)
+
+
+def _solve_chunk(chunk):
+    return [_solve_one(puzzle) for puzzle in chunk]
+
+
+def _solve_one(puzzle):
+    return solve_board(_worker_engine, *puzzle, cache=_worker_cache)
+
+
+def solve_board(engine, puzzle_id, board, cache=None):
+    # The result dict (see RESULT_FIELDS) for solving board, in place, with engine (one of ENGINES' values), or from
+    # cache (a canonical.SolutionCache) if that has an equivalent board. A board of None (one that couldn't be read,
+    # see puzzle_io.read_puzzles) is invalid.
+    t_start = time.perf_counter()
+    try:
+        if board is None:
+            raise ValueError('No board')
+        solved = cache.solve(board, engine) if cache is not None else engine(board).is_solved()
+        status = 'solved' if solved else 'unsolvable'
+    except ValueError:
+        status = 'invalid'
+    elapsed = time.perf_counter() - t_start
+    return {'id': puzzle_id, 'status': status, 'time_ms': round(elapsed * 1000, 3),
+            'solution': board_to_string(board) if status == 'solved' else ''}
+
+
+def write_results(results, out, output_format):
+    # Writes the results as they arrive, as JSON lines or CSV. Returns how many there were of each status.
+    counts = {}
+    with ResultWriter(out, RESULT_FIELDS, output_format) as writer:
+        for result in results:
+            writer.write(result)
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+    return counts
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Solve a collection of Sudoku puzzles')
+    parser.add_argument('source', help='a directory of puzzle files, a glob pattern, or a file of one-line puzzles')
+    parser.add_argument('--input-format', choices=PUZZLE_FORMATS,
+                        help='how puzzles are laid out in the files (default: told from each file)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='bitmask')
+    parser.add_argument('--out', help='file to write results to (default: standard output)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help='output format (default: from the --out extension, else jsonl)')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunksize', type=int, default=64, help='puzzles sent to a worker at a time')
+    parser.add_argument('--cache', type=int, default=0, metavar='SIZE',
+                        help='solutions each worker keeps to answer equivalent puzzles from (default: 0, none)')
+    args = parser.parse_args(argv[1:])
+
+    output_format = args.format
+    if output_format is None:
+        output_format = 'csv' if args.out and args.out.endswith('.csv') else 'jsonl'
+
+    t_start = time.perf_counter()
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        puzzles = iter_puzzles(args.source, args.input_format, keep_invalid=True)
+        results = solve_puzzles(puzzles, args.engine, args.jobs, args.chunksize, args.cache)
+        counts = write_results(results, out, output_format)
+    finally:
+        if args.out:
+            out.close()
+    elapsed = time.perf_counter() - t_start
+
+    total = sum(counts.values())
+    summary = ', '.join('{} {}'.format(count, status) for status, count in sorted(counts.items()))
+    print('{} puzzles in {:.2f}s ({:.0f}/s): {}'.format(total, elapsed, total / elapsed if elapsed else 0, summary),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
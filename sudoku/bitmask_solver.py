@@ -0,0 +1,177 @@
+# bitmask_solver.py: a native Sudoku engine working on candidate bitmasks
+
+import math
+
+
+class BitmaskSudokuSolver:
+
+    def __init__(self, board, verbose=False):
+        # Solves board (rows of ints, 0 for an empty cell) in place, for any side length that's a perfect square.
+        # Value v is bit v-1 of every mask below.
+        self._board = board
+        self._verbose = verbose
+        self._n = len(board)
+        if any(len(row) != self._n for row in board):
+            raise ValueError('The board has different horizontal and vertical sizes')
+        self._units, self._cell_units, self._peers = sudoku_geometry(self._n)
+        self._full = (1 << self._n) - 1
+
+        # The value in each cell (0 if empty), the candidate mask of each empty cell (0 once it's filled), and for
+        # each unit (the rows, then the columns, then the boxes) the mask of values used in it
+        self._values = [0] * (self._n * self._n)
+        self._cands = [self._full] * (self._n * self._n)
+        self._unit_used = [0] * len(self._units)
+
+        self._stats = {'decisions': 0, 'backtracks': 0, 'naked_singles': 0, 'hidden_singles': 0}
+        self._solved = self._setup() and self._solve()
+        if self._solved:
+            for i, v in enumerate(self._values):
+                board[i // self._n][i % self._n] = v
+
+    def is_solved(self):
+        return self._solved
+
+    def get_board(self):
+        return self._board
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    # Internals: cells are indexed r * n + c
+
+    def _setup(self):
+        # Places the clues. Returns False if they contradict each other.
+        for r, row in enumerate(self._board):
+            for c, v in enumerate(row):
+                if v:
+                    if not 0 < v <= self._n:
+                        raise ValueError('Value {} out of range for a {}x{} board'.format(v, self._n, self._n))
+                    i = r * self._n + c
+                    if self._values[i] == v:
+                        continue  # Filled in already as a naked single of the clues before it
+                    if not self._assign(i, 1 << (v - 1)):
+                        return False
+        return True
+
+    def _assign(self, i, bit):
+        # Puts the value with mask bit in cell i and takes it out of the candidates of the cell's peers, then does
+        # the same for every peer that's left with a single candidate (a naked single). Returns False on a
+        # contradiction: a cell with no candidates left.
+        values, cands, unit_used, peers, cell_units = self._values, self._cands, self._unit_used, self._peers, \
+            self._cell_units
+        queue = [(i, bit)]
+        while queue:
+            i, bit = queue.pop()
+            if not cands[i] & bit:
+                return False  # Filled in already, or the value was taken out since it was queued
+            values[i] = bit.bit_length()
+            cands[i] = 0
+            for u in cell_units[i]:
+                unit_used[u] |= bit
+            for p in peers[i]:
+                mask = cands[p]
+                if mask & bit:
+                    mask ^= bit
+                    cands[p] = mask
+                    if not mask:
+                        return False
+                    if not mask & (mask - 1):
+                        queue.append((p, mask))
+                        self._stats['naked_singles'] += 1
+        return True
+
+    def _propagate(self):
+        # Fills in hidden singles (values with one cell left in a row, column or box), each along with the naked
+        # singles it leads to, until there are none. Returns False on a contradiction: a value with no place left in
+        # a unit, or one cell that's the only place for two values.
+        cands, full, unit_used = self._cands, self._full, self._unit_used
+        progress = True
+        while progress:
+            progress = False
+            for u, unit in enumerate(self._units):
+                used = unit_used[u]
+                if used == full:
+                    continue
+                # Values that are a candidate in at least one empty cell of the unit, and in at least two
+                once, twice = 0, 0
+                for i in unit:
+                    mask = cands[i]
+                    twice |= once & mask
+                    once |= mask
+                if once | used != full:
+                    return False
+                hidden = once & ~twice
+                if not hidden:
+                    continue
+                for i in unit:
+                    mask = cands[i] & hidden
+                    if mask:
+                        if mask & (mask - 1):
+                            return False
+                        self._stats['hidden_singles'] += 1
+                        if not self._assign(i, mask):
+                            return False
+                        progress = True
+        return True
+
+    def _pick_cell(self):
+        # The empty cell with the fewest candidates (minimum remaining values), or None if the board is full
+        best, best_count = None, self._n + 1
+        for i, mask in enumerate(self._cands):
+            if mask:
+                count = mask.bit_count()
+                if count < best_count:
+                    best, best_count = i, count
+                    if count == 2:
+                        break  # Can't do better: singles have all been filled in
+        return best
+
+    def _solve(self):
+        # Propagate, then assume the lowest candidate of the MRV cell, trying the next one on a contradiction.
+        # Returns True with the board filled in, or False if there's no solution.
+        # The state is three flat lists of ints, so an assumption saves copies of them to undo it: one entry per
+        # assumption in force, (values, candidates, unit masks before it, cell, candidates not yet tried)
+        decisions = []
+        ok = self._propagate()
+        while True:
+            if ok:
+                i = self._pick_cell()
+                if i is None:
+                    return True
+                untried = self._cands[i]
+            else:
+                # Undo assumptions until we find one with a candidate left to try
+                while decisions:
+                    values, cands, unit_used, i, untried = decisions.pop()
+                    self._values, self._cands, self._unit_used = values, cands, unit_used
+                    self._stats['backtracks'] += 1
+                    if untried:
+                        break
+                else:
+                    return False
+            bit = untried & -untried
+            decisions.append((self._values[:], self._cands[:], self._unit_used[:], i, untried & ~bit))
+            self._stats['decisions'] += 1
+            ok = self._assign(i, bit) and self._propagate()
+
+
+_geometries = {}
+
+
+def sudoku_geometry(n):
+    # For an n x n board: the cells of every unit (the rows, then the columns, then the boxes), the three units
+    # each cell is in, and each cell's peers (the other cells sharing a unit with it). Computed once per size.
+    geometry = _geometries.get(n)
+    if geometry is None:
+        block_size = math.isqrt(n)
+        if block_size * block_size != n:
+            raise ValueError('Board side {} is not a perfect square'.format(n))
+        cell_units = [(i // n, n + i % n, 2 * n + (i // n // block_size) * block_size + (i % n) // block_size)
+                      for i in range(n * n)]
+        units = [[] for _ in range(3 * n)]
+        for i, cell_unit_ids in enumerate(cell_units):
+            for u in cell_unit_ids:
+                units[u].append(i)
+        peers = [sorted({p for u in cell_units[i] for p in units[u]} - {i}) for i in range(n * n)]
+        geometry = _geometries[n] = (units, cell_units, peers)
+    return geometry
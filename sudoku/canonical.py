@@ -0,0 +1,238 @@
+# canonical.py: a canonical form for Sudoku boards under the moves that keep a board valid, and a cache of solutions
+# keyed by it, so a puzzle that's a relabeling, transpose or row/column shuffle of one solved before is a lookup
+
+import math
+import os
+from collections import OrderedDict
+from itertools import permutations, product
+from puzzle_io import board_to_string, parse_puzzle_line
+
+# Most partial or full arrangements canonical_form keeps at once before giving up on a board (see there)
+SEARCH_LIMIT = 256
+
+
+class SudokuTransform:
+
+    __slots__ = ('transposed', 'rows', 'cols', 'digits')
+
+    def __init__(self, transposed, rows, cols, digits):
+        # One of the moves that keep a board valid: transpose it if transposed, then put row rows[i] of it at row i
+        # and column cols[j] at column j, and relabel value v as digits[v] (digits[0] == 0, for empty cells)
+        self.transposed = transposed
+        self.rows = rows
+        self.cols = cols
+        self.digits = digits
+
+    def apply(self, board):
+        # The board this makes of board
+        if self.transposed:
+            board = [list(col) for col in zip(*board)]
+        digits = self.digits
+        return [[digits[board[r][c]] for c in self.cols] for r in self.rows]
+
+    def undo(self, board, out):
+        # Writes into out the board that this makes board of
+        inverse = [0] * len(self.digits)
+        for value, digit in enumerate(self.digits):
+            inverse[digit] = value
+        for i, r in enumerate(self.rows):
+            for j, c in enumerate(self.cols):
+                if self.transposed:
+                    out[c][r] = inverse[board[i][j]]
+                else:
+                    out[r][c] = inverse[board[i][j]]
+
+
+def canonical_form(board, limit=SEARCH_LIMIT):
+    # (key, transform): the smallest board that transpose, band and stack swaps, row and column swaps within a band or
+    # stack, and digit relabeling make of board, as a puzzle_io line (the key), and the SudokuTransform making it.
+    # Boards that are the same up to those moves get the same key. Smallest means the pattern of empty cells first,
+    # read row by row with empty before filled, and then the values, with the digits numbered in order of first
+    # appearance. Returns None for a board so symmetric (such as a nearly empty one) that finding it would take
+    # more than limit arrangements.
+    n = len(board)
+    k = math.isqrt(n)
+    if k * k != n or any(len(row) != n for row in board):
+        raise ValueError('Board side {} is not a perfect square'.format(n))
+    for row in board:
+        for v in row:
+            if not 0 <= v <= n:
+                raise ValueError('Value {} out of range for a {}x{} board'.format(v, n, n))
+
+    # First the empty-cell pattern, a row at a time: each state is (transposed, original rows placed so far, the
+    # columns still free to be ordered), where the columns are a list of blocks of stacks that are still
+    # interchangeable, each stack a tuple of cells of columns (as bitmasks) still interchangeable within it
+    grids = (board, [list(col) for col in zip(*board)])
+    masks = [[sum(1 << c for c, v in enumerate(row) if v) for row in grid] for grid in grids]
+    all_stacks = [(sum(1 << c for c in range(s * k, (s + 1) * k)),) for s in range(k)]
+    states = [(t, (), [all_stacks]) for t in (0, 1)]
+    for i in range(n):
+        best, next_states = None, []
+        for t, rows, blocks in states:
+            if i % k == 0:
+                used_bands = {r // k for r in rows}
+                candidates = [r for r in range(n) if r // k not in used_bands]
+            else:
+                band = rows[-1] // k
+                candidates = [r for r in range(band * k, (band + 1) * k) if r not in rows]
+            for r in candidates:
+                value, refined = _refine(blocks, masks[t][r], k)
+                if best is None or value < best:
+                    best, next_states = value, []
+                if value == best:
+                    next_states.append((t, rows + (r,), refined))
+                    if len(next_states) > limit:
+                        return None
+        states = next_states
+
+    # Then the values, over every arrangement the pattern leaves open: the stacks of a block in any order, and
+    # within each stack the columns of a cell in any order, unless they're empty all the way down (so their order
+    # can't matter)
+    arrangements = []
+    for t, rows, blocks in states:
+        filled = 0
+        for mask in masks[t]:
+            filled |= mask
+        count = 1
+        for block in blocks:
+            count *= math.factorial(len(block))
+            for stack in block:
+                for cell in stack:
+                    if cell & filled:
+                        count *= math.factorial(cell.bit_count())
+        if len(arrangements) + count > limit:
+            return None
+
+        options = []
+        for block in blocks:
+            stack_options = [list(product(*(permutations(_columns(cell)) if cell & filled else [_columns(cell)]
+                                            for cell in stack))) for stack in block]
+            block_options = []
+            for order in permutations(range(len(block))):
+                for arrangement in product(*(stack_options[s] for s in order)):
+                    block_options.append([c for stack in arrangement for cells in stack for c in cells])
+            options.append(block_options)
+        for choice in product(*options):
+            arrangements.append((t, rows, [c for block_cols in choice for c in block_cols]))
+
+    best = None
+    for t, rows, cols in arrangements:
+        grid = grids[t]
+        digits = [0] * (n + 1)
+        next_digit = 1
+        key = []
+        for r in rows:
+            grid_row = grid[r]
+            for c in cols:
+                v = grid_row[c]
+                if v and not digits[v]:
+                    digits[v] = next_digit
+                    next_digit += 1
+                key.append(digits[v])
+        if best is None or key < best[0]:
+            best = (key, t, rows, cols, digits)
+
+    key, t, rows, cols, digits = best
+    # Digits no clue uses take the labels left, in order
+    next_digit = max(digits) + 1
+    for v in range(1, n + 1):
+        if not digits[v]:
+            digits[v] = next_digit
+            next_digit += 1
+    canonical = [key[i * n:(i + 1) * n] for i in range(n)]
+    return board_to_string(canonical), SudokuTransform(bool(t), list(rows), cols, digits)
+
+
+def _refine(blocks, row_mask, k):
+    # The smallest value (a bitmask, filled cells as 1s, first column highest) the row with filled columns row_mask
+    # can take given the column ordering left open by blocks, and the ordering left open once it does
+    value = 0
+    refined = []
+    for block in blocks:
+        chunks = []
+        for stack in block:
+            chunk = 0
+            cells = []
+            for cell in stack:
+                clues = cell & row_mask
+                empties = cell ^ clues
+                size, count = cell.bit_count(), clues.bit_count()
+                chunk = (chunk << size) | ((1 << count) - 1)
+                if empties:
+                    cells.append(empties)
+                if clues:
+                    cells.append(clues)
+            chunks.append((chunk, tuple(cells)))
+        chunks.sort()
+        sub_block = []
+        for s, (chunk, stack) in enumerate(chunks):
+            value = (value << k) | chunk
+            if s and chunk != chunks[s - 1][0]:
+                refined.append(sub_block)
+                sub_block = []
+            sub_block.append(stack)
+        refined.append(sub_block)
+    return value, refined
+
+
+def _columns(cell):
+    # The columns in a cell bitmask
+    return [c for c in range(cell.bit_length()) if cell >> c & 1]
+
+
+class SolutionCache:
+
+    def __init__(self, maxsize=100000, path=None):
+        # Solutions of the last maxsize boards solved through solve(), by canonical form (see canonical_form), so an
+        # equivalent board is answered by mapping a stored solution back rather than solving it. With a path, the
+        # cache starts with the solutions saved there, and save() writes them back.
+        self._maxsize = maxsize
+        self._path = path
+        self._solutions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    key, _, solution = line.rstrip('\n').partition(' ')
+                    if key:
+                        self._store(key, solution)
+
+    def solve(self, board, engine):
+        # Solves board in place with engine(board) (anything with is_solved(), such as solve.ENGINES' values), unless
+        # an equivalent board was solved before. Returns whether it's solved.
+        form = canonical_form(board)
+        if form is None:
+            return engine(board).is_solved()
+        key, transform = form
+        solution = self._solutions.get(key)
+        if solution is not None:
+            self._solutions.move_to_end(key)
+            self.hits += 1
+            if solution:
+                transform.undo(parse_puzzle_line(solution), board)
+            return bool(solution)
+        self.misses += 1
+        solved = engine(board).is_solved()
+        # An empty solution records that there's none
+        self._store(key, board_to_string(transform.apply(board)) if solved else '')
+        return solved
+
+    def save(self):
+        # Writes the cache to its path, whole or not at all
+        if self._path is None:
+            return
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for key, solution in self._solutions.items():
+                f.write('{} {}\n'.format(key, solution))
+        os.replace(temp_path, self._path)
+
+    def __len__(self):
+        return len(self._solutions)
+
+    def _store(self, key, solution):
+        self._solutions[key] = solution
+        self._solutions.move_to_end(key)
+        if len(self._solutions) > self._maxsize:
+            self._solutions.popitem(last=False)
@@ -0,0 +1,126 @@
+# loadgen.py: puts load on a running server.py and reports latency percentiles and throughput
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from itertools import cycle, islice
+from puzzle_io import board_to_string, iter_puzzles
+from solve import ENGINES
+
+
+async def http_client(host, port):
+    # A function sending one request over a kept-alive HTTP connection, returning the response, and the connection
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def send(request):
+        body = json.dumps(request).encode()
+        writer.write('POST /solve HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     '\r\n'.format(host, len(body)).encode('latin-1') + body)
+        await writer.drain()
+        await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return json.loads(await reader.readexactly(length))
+
+    return send, writer
+
+
+async def socket_client(path):
+    # The same over a Unix socket speaking JSON lines, one request at a time
+    reader, writer = await asyncio.open_unix_connection(path)
+
+    async def send(request):
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    return send, writer
+
+
+async def run_load(connect, requests, concurrency):
+    # Sends every request in requests, each of concurrency clients sending its next one as soon as it has the answer
+    # to the last. Returns (latency in seconds, status) for each, and the seconds it all took.
+    requests = iter(requests)
+    samples = []
+
+    async def client():
+        send, writer = await connect()
+        try:
+            for request in requests:
+                t_start = time.perf_counter()
+                response = await send(request)
+                samples.append((time.perf_counter() - t_start, response.get('status')))
+        finally:
+            writer.close()
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return samples, time.perf_counter() - t_start
+
+
+def percentile(sorted_values, fraction):
+    # The nearest-rank percentile of a sorted list
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[status] = statuses.get(status, 0) + 1
+    summary = {'requests': len(samples), 'seconds': round(elapsed, 3),
+               'throughput': round(len(samples) / elapsed, 1) if elapsed else None, 'statuses': statuses}
+    for name, fraction in (('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99), ('max_ms', 1.0)):
+        value = percentile(latencies, fraction)
+        summary[name] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Measure the latency and throughput of server.py')
+    parser.add_argument('source', help='puzzles to send, cycled through as often as it takes (see puzzle_io)')
+    parser.add_argument('--host', default='127.0.0.1', help='HTTP server address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8642, help='HTTP server port (default: 8642)')
+    parser.add_argument('--socket', help='send over this Unix socket instead of HTTP')
+    parser.add_argument('--requests', type=int, default=1000, help='requests to send (default: 1000)')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight at once (default: 16)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='logic')
+    parser.add_argument('--timeout', type=float, help='seconds each request may take (default: the server\'s)')
+    args = parser.parse_args(argv[1:])
+
+    # Puzzles that can't be read are left out, and counted
+    boards = [board for _, board in iter_puzzles(args.source, keep_invalid=True)]
+    puzzles = [board_to_string(board) for board in boards if board is not None]
+    if len(puzzles) < len(boards):
+        print('Skipped {} unreadable puzzles in {}'.format(len(boards) - len(puzzles), args.source), file=sys.stderr)
+    if not puzzles:
+        print('No puzzles in {}'.format(args.source), file=sys.stderr)
+        return
+    options = {'engine': args.engine}
+    if args.timeout is not None:
+        options['timeout'] = args.timeout
+    requests = (dict(options, puzzle=puzzle) for puzzle in islice(cycle(puzzles), args.requests))
+
+    if args.socket:
+        def connect():
+            return socket_client(args.socket)
+    else:
+        def connect():
+            return http_client(args.host, args.port)
+
+    samples, elapsed = asyncio.run(run_load(connect, requests, args.concurrency))
+    print(json.dumps(summarize(samples, elapsed)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
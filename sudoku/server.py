@@ -0,0 +1,310 @@
+# server.py: a long-running local solver service. Takes Sudoku puzzles as JSON over HTTP or a Unix socket, and
+# solves them in batches on a pool of worker processes that keep their models warm.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from batch import solve_board
+from bitmask_solver import sudoku_geometry
+from puzzle_io import board_to_string, parse_puzzle_line
+from solve import ENGINES
+from sudoku_solver import sudoku_template
+
+# HTTP status for each result status; anything else is 200
+HTTP_STATUSES = {'invalid': 400, 'error': 500, 'busy': 503, 'timeout': 504}
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+class SolverService:
+
+    def __init__(self, jobs=None, batch_size=16, batch_delay=0.002, queue_size=1024, cache_size=4096, timeout=10.0):
+        # Solves puzzles handed to solve() on jobs worker processes (one per core by default). Requests wait in a
+        # queue of up to queue_size, and go to the workers batch_size at a time: a batch is sent as soon as it's
+        # full, or batch_delay seconds after its first request, whichever comes first. At most two batches per
+        # worker are out at once, so the queue is where a burst waits, and once it's full new requests are turned
+        # away as 'busy' rather than piling up. The last cache_size results are kept, so asking again for one of
+        # them is a lookup. timeout is the default number of seconds a request may take.
+        self._jobs = jobs or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._queue_size = queue_size
+        self._cache_size = cache_size
+        self._timeout = timeout
+        self._cache = OrderedDict()
+        self._queue = None
+        self._slots = None
+        self._executor = None
+        self._dispatcher = None
+        self._stats = {'requests': 0, 'cache_hits': 0, 'busy': 0, 'timeouts': 0, 'batches': 0, 'solves': 0}
+
+    async def start(self):
+        # Starts the workers, each building its models up front, and the dispatcher feeding them
+        self._queue = asyncio.Queue(self._queue_size)
+        self._slots = asyncio.Semaphore(2 * self._jobs)
+        self._executor = ProcessPoolExecutor(max_workers=self._jobs, initializer=_init_worker)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self._jobs)))
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        self._dispatcher.cancel()
+        self._executor.shutdown(cancel_futures=True)
+
+    async def solve(self, request):
+        # Solves the puzzle in request, a dict with 'puzzle' (a line of cells, see puzzle_io.parse_puzzle_line) or
+        # 'board' (rows of ints, 0 for empty), and optionally 'engine' (see solve.ENGINES; logic by default) and
+        # 'timeout' (seconds). Returns a result dict: 'status' (solved, unsolvable, invalid, timeout, busy or
+        # error), 'solution' (a line of cells, when solved), 'time_ms' (spent solving) and 'cached'.
+        self._stats['requests'] += 1
+        engine = request.get('engine', 'logic')
+        try:
+            if engine not in ENGINES:
+                raise ValueError('Unknown engine {}; choose from {}'.format(engine, ', '.join(sorted(ENGINES))))
+            if 'board' in request:
+                board = [[int(value) for value in row] for row in request['board']]
+            else:
+                board = parse_puzzle_line(request['puzzle'])
+            if not board or any(len(row) != len(board) for row in board):
+                raise ValueError('The board has different horizontal and vertical sizes')
+            timeout = float(request.get('timeout', self._timeout))
+        except (KeyError, TypeError, ValueError) as e:
+            return {'status': 'invalid', 'error': str(e) or 'No puzzle given'}
+
+        key = (engine, board_to_string(board))
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            self._stats['cache_hits'] += 1
+            return dict(result, cached=True)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            # The deadline goes to the worker too, by the wall clock it shares with us
+            self._queue.put_nowait((future, engine, board, time.time() + timeout))
+        except asyncio.QueueFull:
+            self._stats['busy'] += 1
+            return {'status': 'busy'}
+        try:
+            # On timeout the future is cancelled, so a request still queued is dropped rather than solved
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            result = {'status': 'timeout'}
+        except Exception as e:
+            result = {'status': 'error', 'error': repr(e)}
+        if result['status'] == 'timeout':
+            self._stats['timeouts'] += 1
+        elif result['status'] in ('solved', 'unsolvable'):
+            self._cache[key] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return dict(result, cached=False)
+
+    def get_stats(self):
+        return dict(self._stats, queued=self._queue.qsize() if self._queue else 0, cached=len(self._cache),
+                    jobs=self._jobs)
+
+    async def _dispatch(self):
+        # Gathers queued requests into batches and sends each to a worker once one of the batch slots is free
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self._batch_size - 1:
+                await asyncio.sleep(self._batch_delay)
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            batch = [item for item in batch if not item[0].done()]  # Timed out while queued
+            if batch:
+                await self._slots.acquire()
+                self._stats['batches'] += 1
+                self._stats['solves'] += len(batch)
+                loop.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, _solve_batch,
+                                                 [(engine, board, deadline) for _, engine, board, deadline in batch])
+        except Exception as e:
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (future, *_), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    async def handle_http(self, reader, writer):
+        # Serves HTTP/1.1 requests on a connection, keeping it open between them unless asked not to:
+        #   POST /solve with a request for solve() as its JSON body, or with {'puzzles': [...], ...} for several at
+        #       once (each puzzle a line of cells, with 'engine' and 'timeout' applying to all of them), which answers
+        #       with {'results': [...]}
+        #   GET /stats for the service's counters
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length', '0')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if length.isdigit():
+                    body = await reader.readexactly(int(length))
+                    method, path = (request_line.decode('latin-1').split() + ['', ''])[:2]
+                    status, response = await self._route(method, path.split('?')[0], body)
+                else:
+                    # There's no telling where the body ends, so this is the last request on the connection
+                    status, response = 400, {'status': 'invalid', 'error': 'Bad Content-Length {!r}'.format(length)}
+                    keep_alive = False
+                payload = json.dumps(response).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                             'Connection: {}\r\n\r\n'.format(status, HTTP_REASONS[status], len(payload),
+                                                           'keep-alive' if keep_alive else 'close').encode('latin-1'))
+                writer.write(payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_lines(self, reader, writer):
+        # Serves a connection speaking JSON lines: each line is a request for solve(), answered with a line holding
+        # its result, or {'op': 'stats'} for the counters. Requests are handled concurrently and answered as they
+        # finish, each answer carrying the 'id' of its request (if it had one).
+        tasks = set()
+        try:
+            async for line in reader:
+                if line.strip():
+                    task = asyncio.create_task(self._answer_line(line, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _answer_line(self, line, writer):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request is a JSON object')
+        except ValueError as e:
+            response = {'status': 'invalid', 'error': str(e)}
+        else:
+            response = self.get_stats() if request.get('op') == 'stats' else await self.solve(request)
+            if 'id' in request:
+                response['id'] = request['id']
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    async def _route(self, method, path, body):
+        # (HTTP status, response) for a request
+        if path == '/stats':
+            return (200, self.get_stats()) if method == 'GET' else (405, {'error': 'Use GET'})
+        if path != '/solve':
+            return 404, {'error': 'No such endpoint {}'.format(path)}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ValueError('The body is a JSON object')
+        except ValueError as e:
+            return 400, {'status': 'invalid', 'error': str(e)}
+        if 'puzzles' in request:
+            puzzles = request['puzzles']
+            if not isinstance(puzzles, list) or not all(isinstance(puzzle, str) for puzzle in puzzles):
+                return 400, {'status': 'invalid', 'error': 'puzzles is a list of puzzle lines'}
+            options = {key: request[key] for key in ('engine', 'timeout') if key in request}
+            results = await asyncio.gather(*(self.solve(dict(options, puzzle=puzzle)) for puzzle in puzzles))
+            return 200, {'results': results}
+        result = await self.solve(request)
+        return HTTP_STATUSES.get(result['status'], 200), result
+
+
+def _init_worker():
+    # Builds the models a 9x9 board needs (other sizes get built the first time they turn up), so the first
+    # requests don't wait for them
+    sudoku_geometry(9)
+    sudoku_template(9)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _solve_batch(batch):
+    # The result for each (engine, board, deadline) in batch. One whose deadline has passed by the time its turn
+    # comes is skipped: whoever asked has stopped waiting.
+    results = []
+    for engine, board, deadline in batch:
+        if time.time() > deadline:
+            results.append({'status': 'timeout'})
+        else:
+            result = solve_board(ENGINES[engine], None, board)
+            del result['id']
+            results.append(result)
+    return results
+
+
+async def serve(service, host=None, port=None, socket_path=None):
+    # Runs service until cancelled, over HTTP on host:port and/or JSON lines on the Unix socket at socket_path
+    await service.start()
+    servers = []
+    try:
+        if port is not None:
+            servers.append(await asyncio.start_server(service.handle_http, host, port))
+        if socket_path is not None:
+            servers.append(await asyncio.start_unix_server(service.handle_lines, socket_path))
+        for server in servers:
+            for sock in server.sockets:
+                print('Listening on {}'.format(sock.getsockname()), file=sys.stderr)
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        for server in servers:
+            server.close()
+        await service.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Serve the Sudoku solvers locally')
+    parser.add_argument('--host', default='127.0.0.1', help='address to serve HTTP on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, help='port to serve HTTP on (default: 8642 unless --socket is given)')
+    parser.add_argument('--socket', help='Unix socket to serve JSON lines on')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--batch-size', type=int, default=16, help='most puzzles sent to a worker at a time')
+    parser.add_argument('--batch-delay', type=float, default=2.0,
+                        help='milliseconds to wait for a batch to fill up (default: 2)')
+    parser.add_argument('--queue-size', type=int, default=1024, help='requests that may wait before more are refused')
+    parser.add_argument('--cache-size', type=int, default=4096, help='recent results to keep')
+    parser.add_argument('--timeout', type=float, default=10.0, help='default seconds allowed per request')
+    args = parser.parse_args(argv[1:])
+
+    port = args.port if args.port is not None or args.socket else 8642
+    service = SolverService(args.jobs, args.batch_size, args.batch_delay / 1000, args.queue_size, args.cache_size,
+                            args.timeout)
+    try:
+        asyncio.run(serve(service, args.host, port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -2,52 +2,57 @@
 
 import sys
 import math
+from functools import partial
+from sudoku_solver import SudokuSolver, board_to_solver
 from logic_solver import LogicSolver
+from bitmask_solver import BitmaskSudokuSolver
+from canonical import SolutionCache
+from dlx_solver import DLXSolver
+from puzzle_io import iter_puzzles
+from tracing import ConsoleReporter, SamplingProfiler
 
+# Engines selectable by name on the command line. All of them solve the board they're constructed with and expose
+# is_solved() and get_board().
+ENGINES = {'logic': SudokuSolver, 'bitmask': BitmaskSudokuSolver, 'dlx': partial(SudokuSolver, solver_class=DLXSolver)}
 
-def sudoku_logic_solver_driver(board, verbose):
-    solver = LogicSolver(verbose)
-    side_length = len(board)
 
-    print("Initial Board:")
-    print_board(solver.get_board())
-    print()
+def sudoku_logic_solver_driver(board, verbose, solver_class=SudokuSolver, reporter=None, cache=None):
+    # Solves board in place, reporting the boards before and after and how it went to reporter (the console by
+    # default). verbose has the engine report its setup and propagation stages too, to the console. With a cache
+    # (a canonical.SolutionCache), a board equivalent to one solved before is answered from it.
+    if reporter is None:
+        reporter = ConsoleReporter(format_board=format_board)
+    reporter('board', {'label': 'Initial Board', 'board': board})
 
-    # The main loop.
-    # Modify the sets based on our recent discoveries, and collect new discoveries based on it for next time.
-    # Max iters: the number of variables we've got (N^3), so we can accomodate a rate of 1 inference/iter.
-    iters_since_discovery = 0
-    for iternum in range(side_length**3):
+    # Propagate, and search wherever propagation alone gets stuck
+    if cache is not None:
+        solved = cache.solve(board, lambda board: solver_class(board, verbose))
+    else:
+        solved = solver_class(board, verbose).is_solved()
 
-        num_pos_facts_added, num_neg_facts_added = solver.get_last_discoveries()
-        num_sets = solver.get_num_sets()
+    reporter('result', {'solved': solved})
+    reporter('board', {'label': 'Final Board', 'board': board})
+    reporter('finished', {})
 
-        print('Starting Iteration #{}'.format(iternum+1))
-        print("Sets: {}".format(num_sets))
-        print("Accounting for new knowledge: {} positive facts, {} negative.".format(num_pos_facts_added, num_neg_facts_added))
 
-        solver.run_iter()
+def count_sudoku_solutions(board, limit=2, solver_class=LogicSolver):
+    # The number of solutions the board has, counting no further than limit; with the default limit of 2 this is a
+    # uniqueness check that stops as soon as a second solution turns up. solver_class is any engine with
+    # count_solutions, such as LogicSolver or dlx_solver.DLXSolver.
+    solver = board_to_solver(board, solver_class=solver_class)
+    return solver.count_solutions(limit)
 
-        print("Updated Board:")
-        print_board(board)
 
-        print()
-
-        # Should we continue?
-        if solver.is_done():
-            print("Puzzle complete!")
-            break
-
-    num_pos_facts_added, num_neg_facts_added = solver.get_last_discoveries()
-    num_sets = solver.get_num_sets()
-
-    print("Final Sets: {}".format(num_sets))
-    print("Knowledge from last iteration: {} positive facts, {} negative.".format(num_pos_facts_added, num_neg_facts_added))
-    print('Finished')
+def has_unique_solution(board, solver_class=LogicSolver):
+    return count_sudoku_solutions(board, 2, solver_class) == 1
 
 
 # TODO: this one should be part of board class when we make that
 def print_board(board):
+    print(format_board(board))
+
+
+def format_board(board):
     board_size = len(board)
     block_size = int(math.sqrt(board_size))
     board_as_chars = [[(str(value) if value > 0 else ' ') for value in row] for row in board]
@@ -61,8 +66,7 @@ def print_board(board):
     for divider_row in range(board_size - block_size, 0, -block_size):
         board_as_chars.insert(divider_row, ['-']*(board_size+block_size-1))
 
-    printable_grid = '\n'.join([''.join(row) for row in board_as_chars])
-    print(printable_grid)
+    return '\n'.join([''.join(row) for row in board_as_chars])
 
 
 def parse_character_as_sudoku_value(character):
@@ -71,11 +75,46 @@ def parse_character_as_sudoku_value(character):
 
 def main(argv):
 
-    # Get the board from the file in the first argument
-    with open(argv[1]) as f:
-        board = [[parse_character_as_sudoku_value(char) for char in row.strip()] for row in f]
-
-        sudoku_logic_solver_driver(board, verbose=False)
+    # With --batch first, hand over to batch.py for a whole directory, glob or dataset file of puzzles
+    if len(argv) > 1 and argv[1] == '--batch':
+        import batch
+        batch.main(argv[:1] + argv[2:])
+        return
+
+    # --verbose anywhere has the engine report its setup and propagation stages, and --profile samples where the
+    # time goes and reports that at the end. --cache answers puzzles equivalent to one solved earlier in the run from
+    # a cache of solutions (see canonical.py), and --cache-file PATH does too, keeping the cache in PATH between runs.
+    cache = None
+    if '--cache-file' in argv[1:-1]:
+        i = argv.index('--cache-file')
+        cache = SolutionCache(path=argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+    flags = {arg for arg in argv[1:] if arg in ('--verbose', '--profile', '--cache')}
+    argv = [arg for arg in argv if arg not in flags]
+    if cache is None and '--cache' in flags:
+        cache = SolutionCache()
+
+    # Get the board from the file in the first argument, and the engine from the optional second one
+    solver_class = SudokuSolver
+    if len(argv) > 2:
+        if argv[2] not in ENGINES:
+            print('Unknown engine {}; choose from {}'.format(argv[2], ', '.join(sorted(ENGINES))))
+            return
+        solver_class = ENGINES[argv[2]]
+
+    # The file may hold more than one puzzle (see puzzle_io.read_puzzles); each is solved in turn
+    profiler = SamplingProfiler() if '--profile' in flags else None
+    for _, board in iter_puzzles(argv[1]):
+        if profiler is not None:
+            with profiler:
+                sudoku_logic_solver_driver(board, '--verbose' in flags, solver_class, cache=cache)
+        else:
+            sudoku_logic_solver_driver(board, '--verbose' in flags, solver_class, cache=cache)
+    if profiler is not None:
+        profiler.report()
+    if cache is not None:
+        cache.save()
+        print('Cache: {} hits, {} misses'.format(cache.hits, cache.misses), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -1,74 +1,138 @@
 # sudoku_solver.py: a Sudoku solver using logic_solver
 
 import math
+from functools import lru_cache
+from logic_solver import LogicSolver
+from tracing import ConsoleReporter
+
 
 class SudokuSolver:
 
-    # TODO this whole thing
-    def __init__(self, board, verbose=False):
+    def __init__(self, board, verbose=False, solver_class=LogicSolver, reporter=None):
+        # solver_class picks the engine: LogicSolver, or one with the same interface such as
+        # bitset_solver.BitsetSolver, cdcl_solver.CDCLSolver or dlx_solver.DLXSolver. reporter(event, data) hears
+        # how the setup goes (see tracing.ConsoleReporter); verbose reports to the console if no reporter is given,
+        # and adds the engine's stage events to it.
+        if reporter is None and verbose:
+            reporter = ConsoleReporter()
         self._board = board
         self._verbose = verbose
-        self._prop_sets = board_to_prop_sets(board,verbose)
-        pass
+        self._logicsolver = board_to_solver(board, verbose, solver_class, reporter)
+        if verbose and reporter is not None and hasattr(self._logicsolver, 'set_tracer'):
+            self._logicsolver.set_tracer(reporter)
         self._solve()
 
     def _solve(self):
-        pass
+        self._solved = self._logicsolver.solve()
+        if self._solved:
+            pos_knowledge, _ = self._logicsolver.get_knowledge()
+            knowledge_to_board(pos_knowledge, self._board)
+
+    def is_solved(self):
+        return self._solved
+
+    def get_board(self):
+        return self._board
+
+
+def board_to_solver(board, verbose=False, solver_class=LogicSolver, reporter=None):
+    # A new solver_class solver loaded with the board's equations and clues. Engines that can be stamped out of a
+    # compiled template (LogicSolver.from_template) get the one for this size, rather than every equation again.
+    if any(len(row) != len(board) for row in board):
+        raise ValueError('The board has different horizontal and vertical sizes')
+    if hasattr(solver_class, 'from_template'):
+        logicsolver = solver_class.from_template(sudoku_template(len(board)), verbose)
+        add_clues(logicsolver, board, reporter)
+    else:
+        logicsolver = solver_class(verbose)
+        board_to_prop_sets(logicsolver, board, reporter)
+    return logicsolver
+
 
-def board_to_prop_sets(board, verbose=False):
+def board_to_prop_sets(logicsolver, board, reporter=None):
     # Build listing of prop sets
     side_length = len(board)  # To be an argument later, or inferred from input board
-    if len(board[0]) != side_length:
-        print('Error: the board has different horizontal and vertical sizes!')
-        return
+    if any(len(row) != side_length for row in board):
+        raise ValueError('The board has different horizontal and vertical sizes')
 
-    block_size = int(math.sqrt(side_length))  # cells along a side of a block
+    add_sudoku_equations(logicsolver, side_length)
+    add_clues(logicsolver, board, reporter)
+
+
+@lru_cache(maxsize=8)
+def sudoku_template(side_length):
+    # The LogicSolver model of an empty side_length x side_length board, compiled once per size
+    logicsolver = LogicSolver()
+    add_sudoku_equations(logicsolver, side_length)
+    return logicsolver.compile()
+
+
+def add_sudoku_equations(logicsolver, side_length):
+    block_size = math.isqrt(side_length)  # cells along a side of a block
+    if block_size * block_size != side_length:
+        raise ValueError('Board side {} is not a perfect square'.format(side_length))
     block_count = block_size  # number of blocks in each direction
 
     # Build up list of sets relating propositions. All the initial group will be XOR sets.
-    prop_sets = []
     # Sets to require uniqueness of each cell's value
     for r in range(side_length):
         for c in range(side_length):
-            new_set = set()
+            new_set = []
             for v in range(side_length):
-                new_set.add(create_1indexed_string(r, c, v))
-            prop_sets.append(PropositionSet(new_set))
+                new_set.append(create_1indexed_string(r, c, v))
+            logicsolver.add_equation(new_set, 'xor')
 
     # Sets to require that each row only contain each value exactly once
     for r in range(side_length):
         for v in range(side_length):
-            new_set = set()
+            new_set = []
             for c in range(side_length):
-                new_set.add(create_1indexed_string(r, c, v))
-            prop_sets.append(PropositionSet(new_set))
+                new_set.append(create_1indexed_string(r, c, v))
+            logicsolver.add_equation(new_set, 'xor')
 
     # Sets to require that each column only contain each value exactly once
     for c in range(side_length):
         for v in range(side_length):
-            new_set = set()
+            new_set = []
             for r in range(side_length):
-                new_set.add(create_1indexed_string(r, c, v))
-            prop_sets.append(PropositionSet(new_set))
+                new_set.append(create_1indexed_string(r, c, v))
+            logicsolver.add_equation(new_set, 'xor')
 
     # Sets to require that each block only contain each value exactly once
     for v in range(side_length):
         for block_index_horiz in range(block_count):
             for block_index_vert in range(block_count):
-                new_set = set()
+                new_set = []
                 for row_within_block in range(block_size):
                     r = block_index_vert * block_size + row_within_block
                     for col_within_block in range(block_size):
                         c = block_index_horiz * block_size + col_within_block
-                        new_set.add(create_1indexed_string(r, c, v))
-                prop_sets.append(PropositionSet(new_set))
-
-    print("Initialized with {} sets.".format(len(prop_sets)))
-    if verbose:
-        print("Initial Sets:")
-        pprint(prop_sets)
-
-    return prop_sets
+                        new_set.append(create_1indexed_string(r, c, v))
+                logicsolver.add_equation(new_set, 'xor')
+
+
+def add_clues(logicsolver, board, reporter=None):
+    # Take apart board's initial state and break into true propositions. A value outside 1..n has no proposition
+    # in any equation, so it would be taken on trust rather than checked: reject it.
+    side_length = len(board)
+    clues = []
+    for r, boardrow in enumerate(board):
+        for c, v in enumerate(boardrow):
+            if v != 0:
+                if not 0 < v <= side_length:
+                    raise ValueError('Value {} out of range for a {}x{} board'.format(v, side_length, side_length))
+                clues.append(create_1indexed_string(r, c, v - 1))  # v-1 because it's already 1-indexed
+    logicsolver.add_true_propositions(clues)
+
+    if reporter is not None:
+        reporter('initialized', {'sets': logicsolver.get_num_sets(), 'clues': len(clues)})
+
+
+def knowledge_to_board(pos_knowledge, board):
+    # Fills in the board from the True propositions we've found
+    for datum in pos_knowledge:
+        r_1ind, c_1ind, v = parse_1indexed_string(datum)
+        board[r_1ind - 1][c_1ind - 1] = v
 
 
 def create_1indexed_string(r, c, v):
@@ -0,0 +1,116 @@
+# tracing.py: reporters for the events solvers emit (see LogicSolver.set_tracer), and a sampling profiler that tells
+# which propagation stage the time goes to
+
+import sys
+import threading
+from collections import Counter
+from pprint import pformat
+from time import perf_counter
+
+# What a sample in each function counts towards, for SamplingProfiler: the innermost of these on the stack wins
+STAGE_FUNCTIONS = {'_apply_queued': 'apply', '_pair_reduce': 'pair_reduce', '_triplet_reduce': 'triplet_reduce',
+                   '_propagate_vectorized': 'vectorized', '_search': 'search', 'add_equation': 'build',
+                   'add_knowledge': 'build', 'from_template': 'build', 'compile': 'build'}
+
+
+class ConsoleReporter:
+
+    def __init__(self, out=None, format_board=pformat, search=False):
+        # Writes events as text lines to out (standard output by default), for the solvers' reporter and tracer
+        # arguments. Boards are shown with format_board. The search events ('decision', 'backtrack', 'solution'),
+        # one per step, are only shown with search=True.
+        self._out = out
+        self._format_board = format_board
+        self._search = search
+
+    def __call__(self, event, data):
+        out = self._out if self._out is not None else sys.stdout
+        if event == 'board':
+            if data.get('label'):
+                print('{}:'.format(data['label']), file=out)
+            print(self._format_board(data['board']), file=out)
+            if data.get('label') == 'Initial Board':
+                print(file=out)
+        elif event == 'initialized':
+            print('Initialized with {} sets and {} clues.'.format(data['sets'], data['clues']), file=out)
+        elif event == 'candidates':
+            print('Candidates: {} of {}'.format(data['count'], data['total']), file=out)
+        elif event == 'sets':
+            print('Sets: {}'.format(data['count']), file=out)
+        elif event == 'structural_eliminations':
+            print('Structural eliminations: {}'.format(data['count']), file=out)
+        elif event == 'result':
+            print('Puzzle complete!' if data['solved'] else 'Puzzle has no solution!', file=out)
+        elif event == 'summary':
+            print('Final Sets: {}'.format(data['sets']), file=out)
+            print('Knowledge: {} positive facts, {} negative.'.format(data['positive'], data['negative']), file=out)
+        elif event == 'finished':
+            print('Finished', file=out)
+        elif event in ('decision', 'backtrack', 'solution'):
+            if self._search:
+                print('{}: {}'.format(event, ', '.join('{}={}'.format(k, v) for k, v in data.items())), file=out)
+        else:
+            # A propagation stage: LogicSolver's metrics for the run
+            print('{}: {} facts applied, {} equations touched, {} inferred, {} equations added{} ({:.3f} ms)'.format(
+                event, data['facts_applied'], data['eqns_touched'], data['inferences'], data['eqns_added'],
+                ', contradiction' if data['contradictions'] else '', data['time'] * 1000), file=out)
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005, thread=None):
+        # Samples the stack of thread (the one creating the profiler by default) every interval seconds from a
+        # background thread while in use as a context manager, without touching the solver: it costs the profiled
+        # code nothing but the sampling thread's share of the interpreter. Each sample counts towards the stage of
+        # the innermost solver function on the stack (see STAGE_FUNCTIONS, 'other' if none), and towards the
+        # function the stack ends in. The sampler needs the GIL to take a sample, so it gets no more than one per
+        # sys.getswitchinterval() (5 ms by default) however small the interval.
+        self._interval = interval
+        self._thread_id = (thread or threading.current_thread()).ident
+        self._stages = Counter()
+        self._functions = Counter()
+        self._samples = 0
+        self._elapsed = 0.0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        self._stop.clear()
+        self._t_start = perf_counter()
+        self._sampler = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._sampler.join()
+        self._elapsed += perf_counter() - self._t_start
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            code = frame.f_code
+            self._functions['{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno)] += 1
+            stage = None
+            while frame is not None:
+                stage = STAGE_FUNCTIONS.get(frame.f_code.co_name)
+                if stage is not None:
+                    break
+                frame = frame.f_back
+            self._stages[stage or 'other'] += 1
+            self._samples += 1
+
+    def get_stages(self):
+        # {stage: fraction of the samples}
+        return {stage: count / self._samples for stage, count in self._stages.most_common()} if self._samples else {}
+
+    def report(self, top=10, out=None):
+        # Writes the share of the samples each stage got, and the top functions they ended in
+        out = out if out is not None else sys.stdout
+        print('{} samples over {:.3f}s'.format(self._samples, self._elapsed), file=out)
+        for stage, fraction in self.get_stages().items():
+            print('  {:<16}{:6.1%}'.format(stage, fraction), file=out)
+        for function, count in self._functions.most_common(top):
+            print('  {:6.1%}  {}'.format(count / self._samples, function), file=out)